@@ -0,0 +1,74 @@
+# attachments.py
+from email_summarizer.email_summarizer import authenticate_gmail, get_attachment_bytes
+from database.database import SessionLocal
+from database.models import Email, EmailAttachment
+from utils.attachment_store import attachment_store
+import threading
+
+# Striped locks: concurrent requests for one attachment share a single download
+_fetch_locks = [threading.Lock() for _ in range(64)]
+
+
+def _lookup(email_id, attachment_id):
+    db = SessionLocal()
+    try:
+        row = db.query(
+            EmailAttachment.filename,
+            EmailAttachment.mime_type,
+            EmailAttachment.size,
+            EmailAttachment.content_hash,
+            Email.user_email
+        ).join(Email, Email.email_id == EmailAttachment.email_id).filter(
+            EmailAttachment.email_id == email_id,
+            EmailAttachment.attachment_id == attachment_id
+        ).first()
+    finally:
+        db.close()
+    return row._asdict() if row else None
+
+
+def _record_content(email_id, attachment_id, digest, size):
+    db = SessionLocal()
+    try:
+        db.query(EmailAttachment).filter(
+            EmailAttachment.email_id == email_id,
+            EmailAttachment.attachment_id == attachment_id
+        ).update({"content_hash": digest, "size": size}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def open_attachment(email_id, attachment_id):
+    """Return (attachment info, open file) for an attachment's content, or (None, None).
+
+    Content is read from the attachment store when this attachment was
+    fetched before and hasn't been evicted; otherwise it is downloaded from
+    Gmail once, stored by content hash and recorded on the attachment row.
+    """
+    info = _lookup(email_id, attachment_id)
+    if info is None:
+        return None, None
+    if info["content_hash"]:
+        f = attachment_store.open(info["content_hash"])
+        if f:
+            return info, f
+
+    with _fetch_locks[hash((email_id, attachment_id)) % len(_fetch_locks)]:
+        # Another request may have stored it while we waited
+        info = _lookup(email_id, attachment_id)
+        if info is None:
+            # Deleted while we waited
+            return None, None
+        if info["content_hash"]:
+            f = attachment_store.open(info["content_hash"])
+            if f:
+                return info, f
+
+        service = authenticate_gmail(info["user_email"])
+        data = get_attachment_bytes(service, email_id, attachment_id)
+        digest = attachment_store.put(data)
+        _record_content(email_id, attachment_id, digest, len(data))
+
+    info.update(content_hash=digest, size=len(data))
+    return info, attachment_store.open(digest)
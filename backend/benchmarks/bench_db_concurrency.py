@@ -0,0 +1,135 @@
+"""Concurrent /search + ingest load against the configured database.
+
+Writer threads bulk-insert synthetic emails through save_emails while
+reader threads run full_text_search, for a fixed duration. Reports
+throughput, latency percentiles and lock errors for each side.
+
+Run from backend/:
+    python -m benchmarks.bench_db_concurrency                      # tuned SQLite in a temp dir
+    SQLITE_TUNING=0 python -m benchmarks.bench_db_concurrency      # SQLite defaults
+    DATABASE_URL=postgresql+psycopg2://... python -m benchmarks.bench_db_concurrency
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+WORDS = (
+    "invoice meeting project update weekly report team lunch budget review "
+    "quarterly plan release notes payment due reminder offer sale order "
+    "shipped delivery account security alert password reset newsletter"
+).split()
+
+
+# Long tail of rarer words so subjects and bodies look like a real mailbox
+VOCAB = WORDS + [f"{a}{b}" for a in ("pro", "con", "re", "de", "in", "ex") for b in WORDS]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def make_email(rng, n):
+    subject = " ".join(rng.choices(VOCAB, k=rng.randint(3, 7))) + f" {rng.randint(1, 10 ** 6)}"
+    return {
+        "email_id": f"bench-{n}-{rng.getrandbits(48):x}",
+        "sender": f"{rng.choice(WORDS)} <{rng.choice(WORDS)}@example.com>",
+        "subject": subject,
+        "body": " ".join(rng.choices(VOCAB, k=200)),
+        "summary": subject,
+        "priority": "Medium",
+        "category": "Work",
+        "thread_id": None,
+        "attachments": []
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=20, help="emails per save_emails call")
+    parser.add_argument("--seed-rows", type=int, default=20000)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if "DATABASE_URL" not in os.environ:
+        tmp = tempfile.mkdtemp()
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+
+    # Imported after DATABASE_URL is set so the engine picks it up
+    from database.schema import init_db
+    from database.database import SessionLocal
+    from database.helpers import save_emails
+    from database.search import full_text_search
+
+    init_db()
+    user = "bench@example.com"
+    rng = random.Random(1)
+    for start in range(0, args.seed_rows, 500):
+        save_emails(user, [make_email(rng, start + i) for i in range(500)])
+
+    stop = time.perf_counter() + args.duration
+    stats = {"write": [], "read": [], "write_errors": 0, "read_errors": 0}
+    lock = threading.Lock()
+
+    def writer(seed):
+        rng = random.Random(seed)
+        n = 0
+        while time.perf_counter() < stop:
+            batch = [make_email(rng, n + i) for i in range(args.batch)]
+            n += args.batch
+            started = time.perf_counter()
+            try:
+                save_emails(user, batch)
+            except Exception:
+                with lock:
+                    stats["write_errors"] += 1
+                continue
+            with lock:
+                stats["write"].append(time.perf_counter() - started)
+
+    def reader(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < stop:
+            q = " ".join(rng.choices(WORDS, k=2))
+            started = time.perf_counter()
+            db = SessionLocal()
+            try:
+                full_text_search(db, user, q, limit=20)
+            except Exception:
+                with lock:
+                    stats["read_errors"] += 1
+                continue
+            finally:
+                db.close()
+            with lock:
+                stats["read"].append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(1000 + i,)) for i in range(args.readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f"database: {os.environ['DATABASE_URL']}  tuning: {os.getenv('SQLITE_TUNING', '1')}")
+    for side, unit in (("write", args.batch), ("read", 1)):
+        latencies = stats[side]
+        print(
+            f"{side:>5}: {len(latencies) * unit / args.duration:>9,.0f} {'emails' if unit > 1 else 'queries'}/s"
+            f"  p50 {percentile(latencies, 50) * 1000:7.1f} ms"
+            f"  p99 {percentile(latencies, 99) * 1000:7.1f} ms"
+            f"  mean {(statistics.mean(latencies) if latencies else 0) * 1000:7.1f} ms"
+            f"  errors {stats[side + '_errors']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
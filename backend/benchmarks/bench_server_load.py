@@ -0,0 +1,184 @@
+"""HTTP load test of the API server with Gmail and the LLM mocked out.
+
+Starts the real FastAPI app under uvicorn against a temp SQLite DB, with
+Gmail calls replaced by synthetic messages (plus --gmail-latency) and
+OpenRouter replaced by benchmarks.fakes (plus --llm-latency). Then
+--clients concurrent clients loop over a mix of endpoints for
+--duration seconds and p50 / p99 latency is reported per endpoint.
+
+Run from backend/:
+    python -m benchmarks.bench_server_load --clients 100 --duration 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import types
+
+from benchmarks.bench_db_concurrency import WORDS, VOCAB, percentile
+from benchmarks.fakes import start_fake_llm
+
+
+def install_fake_gmail(server, ingest, users, gmail_latency, per_fetch, new_per_fetch):
+    """Replace the Gmail calls used by /fetch-emails with synthetic, slightly growing inboxes."""
+    counters = {user: 0 for user in users}
+    lock = threading.Lock()
+
+    def authenticate_gmail(user_email):
+        return types.SimpleNamespace(user=user_email)
+
+    def get_last_24h_emails(service, max_results=20):
+        time.sleep(gmail_latency)
+        with lock:
+            counters[service.user] += new_per_fetch
+            newest = counters[service.user] + per_fetch
+        return [{"id": f"{service.user}-{n}"} for n in range(newest - 1, newest - 1 - per_fetch, -1)]
+
+    def fetch_new_emails(service, msg_ids, user_email=None):
+        time.sleep(gmail_latency)
+        rng = random.Random(len(msg_ids))
+        return {
+            msg_id: {
+                "email_id": msg_id,
+                "sender": f"{rng.choice(WORDS)} <{rng.choice(WORDS)}@example.com>",
+                "subject": " ".join(rng.choices(VOCAB, k=5)),
+                "body": ". ".join(" ".join(rng.choices(VOCAB, k=12)) for _ in range(8)),
+                "thread_id": msg_id,
+                "attachments": [],
+                "headers": {}
+            }
+            for msg_id in msg_ids
+        }
+
+    server.authenticate_gmail = authenticate_gmail
+    server.get_last_24h_emails = get_last_24h_emails
+    ingest.fetch_new_emails = fetch_new_emails
+
+
+def start_server(app, port):
+    import uvicorn
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+    uv = uvicorn.Server(config)
+    threading.Thread(target=uv.run, daemon=True).start()
+    while not uv.started:
+        time.sleep(0.05)
+    return uv
+
+
+async def run_clients(base_url, users, clients, duration, fetch_share):
+    import httpx
+
+    latencies = {}
+    errors = {}
+    stop = time.perf_counter() + duration
+
+    def pick_request(rng):
+        user = rng.choice(users)
+        if rng.random() < fetch_share:
+            return "fetch-emails", "GET", "/fetch-emails", {"user_email": user}
+        choice = rng.randrange(5)
+        if choice == 0:
+            return "search", "GET", "/search", {"user_email": user, "q": " ".join(rng.choices(WORDS, k=2))}
+        if choice == 1:
+            return "threads", "GET", "/threads", {"user_email": user, "mode": "category"}
+        if choice == 2:
+            return "smart-threads", "GET", "/smart-threads", {"user_email": user, "limit": 20}
+        if choice == 3:
+            return "category-stats", "GET", "/category-stats", {"user_email": user}
+        return "feedback", "POST", "/feedback", {"email_id": f"{user}-1", "priority": "High", "is_correct": "true"}
+
+    async def client_loop(seed, http):
+        rng = random.Random(seed)
+        while time.perf_counter() < stop:
+            name, method, path, params = pick_request(rng)
+            started = time.perf_counter()
+            try:
+                if method == "GET":
+                    response = await http.get(path, params=params)
+                else:
+                    response = await http.post(path, data=params)
+                ok = response.status_code == 200 and "error" not in response.text[:20]
+            except httpx.HTTPError:
+                ok = False
+            elapsed = time.perf_counter() - started
+            if ok:
+                latencies.setdefault(name, []).append(elapsed)
+            else:
+                errors[name] = errors.get(name, 0) + 1
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as http:
+        await asyncio.gather(*[client_loop(i, http) for i in range(clients)])
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--fetch-share", type=float, default=0.2, help="share of requests that are /fetch-emails")
+    parser.add_argument("--per-fetch", type=int, default=20, help="messages listed per /fetch-emails")
+    parser.add_argument("--new-per-fetch", type=int, default=2, help="unseen messages per /fetch-emails")
+    parser.add_argument("--gmail-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    llm = start_fake_llm(args.llm_latency)
+
+    # Set before the app is imported so every client and engine picks them up
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+    os.environ["OPENROUTER_BASE_URL"] = llm.base_url
+    os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+    os.environ["LLM_CACHE_PATH"] = f"{tmp}/llm_cache.db"
+    os.environ["LOCAL_MODEL_PATH"] = f"{tmp}/local_classifier.pkl"
+    os.environ["SENDER_RULES_PATH"] = f"{tmp}/sender_rules.json"
+    os.environ.setdefault("LLM_CACHE_ENABLED", "0")
+    os.chdir(tmp)
+
+    users = [f"user{i}@example.com" for i in range(args.users)]
+    os.makedirs("tokens")
+    for user in users:
+        with open(f"tokens/{user}.json", "w") as f:
+            f.write("{}")
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import scheduler
+    # The app starts the background scheduler on import; keep its jobs out of the numbers
+    scheduler.start_scheduler = lambda: None
+    import server
+    import ingest
+
+    install_fake_gmail(server, ingest, users, args.gmail_latency, args.per_fetch, args.new_per_fetch)
+    uv = start_server(server.app, args.port)
+
+    latencies, errors = asyncio.run(run_clients(
+        f"http://127.0.0.1:{args.port}", users, args.clients, args.duration, args.fetch_share
+    ))
+    uv.should_exit = True
+
+    total = sum(len(v) for v in latencies.values())
+    print(
+        f"clients: {args.clients}  duration: {args.duration:.0f}s  "
+        f"gmail latency: {args.gmail_latency * 1000:.0f} ms  llm latency: {args.llm_latency * 1000:.0f} ms"
+    )
+    print(f"total: {total / args.duration:,.1f} req/s  llm calls: {llm.calls}")
+    for name in sorted(set(latencies) | set(errors)):
+        values = latencies.get(name, [])
+        print(
+            f"{name:>15}: {len(values):>6} ok"
+            f"  p50 {percentile(values, 50) * 1000:8.1f} ms"
+            f"  p99 {percentile(values, 99) * 1000:8.1f} ms"
+            f"  errors {errors.get(name, 0)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
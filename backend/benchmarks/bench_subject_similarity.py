@@ -0,0 +1,74 @@
+"""Pairs/second of the pairwise subject_similarity vs the batch APIs.
+
+Run from backend/:  python -m benchmarks.bench_subject_similarity [--sizes 1000 10000 100000]
+"""
+import argparse
+import random
+import time
+
+from utils.subject_similarity import (
+    subject_similarity,
+    subject_similarity_batch,
+    subject_similarity_matrix,
+)
+
+WORDS = (
+    "invoice meeting project update weekly report team lunch budget review "
+    "quarterly plan release notes payment due reminder offer sale order "
+    "shipped delivery account security alert password reset newsletter "
+    "webinar invitation confirmed ticket booking interview schedule"
+).split()
+PREFIXES = ["", "", "", "Re: ", "Fwd: "]
+
+
+def make_subjects(n, seed=42):
+    rng = random.Random(seed)
+    return [
+        rng.choice(PREFIXES) + " ".join(rng.choices(WORDS, k=rng.randint(2, 7))) + f" #{rng.randint(1, n)}"
+        for _ in range(n)
+    ]
+
+
+def bench_pairwise(query, subjects, max_pairs):
+    sample = subjects[:max_pairs]
+    start = time.perf_counter()
+    for s in sample:
+        subject_similarity(query, s)
+    return len(sample) / (time.perf_counter() - start)
+
+
+def bench_batch(query, subjects):
+    start = time.perf_counter()
+    subject_similarity_batch(query, subjects)
+    return len(subjects) / (time.perf_counter() - start)
+
+
+def bench_matrix(subjects, rows):
+    queries = subjects[:rows]
+    start = time.perf_counter()
+    subject_similarity_matrix(queries, subjects)
+    return len(queries) * len(subjects) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--pairwise-sample", type=int, default=500,
+                        help="pairs timed for the pairwise function (rate is extrapolated)")
+    parser.add_argument("--matrix-rows", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'subjects':>10} {'pairwise pairs/s':>18} {'batch pairs/s':>16} {'matrix pairs/s':>16} {'speedup':>9}")
+    for n in args.sizes:
+        subjects = make_subjects(n)
+        query = subjects[n // 2]
+
+        pairwise = bench_pairwise(query, subjects, args.pairwise_sample)
+        batch = bench_batch(query, subjects)
+        matrix = bench_matrix(subjects, args.matrix_rows)
+
+        print(f"{n:>10} {pairwise:>18,.0f} {batch:>16,.0f} {matrix:>16,.0f} {batch / pairwise:>8,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""End-to-end hot-path benchmarks against fake Gmail and LLM services.
+
+Runs each scenario against a temp SQLite DB, a FakeGmail mailbox of
+--mailbox messages and the fake LLM server (--llm-latency), and reports
+throughput, latency percentiles and tracemalloc peak memory:
+
+    get_email_details       one full message fetch + MIME parse
+    save_email              one email categorized (rules / LLM) and saved
+    assign_smart_thread_id  one subject matched against the mailbox index
+    search                  GET /search
+    threads                 GET /threads (subject and category modes)
+    auto_fetch_emails       one scheduler cycle over --users mailboxes,
+                            each receiving --new-per-cycle messages
+
+Results can be stored and compared, so a change can be checked against
+a previous run. benchmarks/baseline.json is the reference run committed
+with the code; --compare and --save-baseline use it when given no path.
+Its meta block records the machine and parameters it was taken with, and
+comparing across a different setup prints a warning, since absolute
+numbers only mean something on like hardware. Refresh it with
+--save-baseline in the same change as an intended performance shift.
+
+Run from backend/:
+    python -m benchmarks.bench_suite --compare
+    python -m benchmarks.bench_suite --save-baseline
+    python -m benchmarks.bench_suite --compare /tmp/my-baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.bench_db_concurrency import WORDS, percentile
+from benchmarks.fakes import FakeGmail, start_fake_llm
+
+SCENARIOS = [
+    "get_email_details",
+    "save_email",
+    "assign_smart_thread_id",
+    "search",
+    "threads",
+    "auto_fetch_emails",
+]
+
+USER = "bench@example.com"
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def measure(op, ops, items_per_op=1, memory=True):
+    """Call op(i) ops times; returns throughput, latency percentiles and peak traced memory."""
+    if memory:
+        tracemalloc.start()
+    latencies = []
+    started = time.perf_counter()
+    for i in range(ops):
+        op_started = time.perf_counter()
+        op(i)
+        latencies.append(time.perf_counter() - op_started)
+    seconds = time.perf_counter() - started
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        "ops": ops,
+        "seconds": round(seconds, 4),
+        "items_per_s": round(ops * items_per_op / seconds, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "peak_mb": round(peak / 2 ** 20, 2),
+    }
+
+
+def seed_mailbox(gmail, user_email):
+    """Store the whole fake mailbox for user_email through the normal bulk path."""
+    from email_summarizer.email_summarizer import get_emails_details_batch
+    from database.helpers import save_emails
+
+    ids = [gmail.message_id(i) for i in range(gmail.count)]
+    for start in range(0, len(ids), 500):
+        fetched = get_emails_details_batch(gmail, ids[start:start + 500])
+        save_emails(user_email, [
+            {
+                "email_id": msg_id,
+                "sender": sender,
+                "subject": subject,
+                "body": body,
+                "summary": body[:200],
+                "priority": random.Random(msg_id).choice(["High", "Medium", "Low"]),
+                "category": random.Random(msg_id).choice(["Work", "Personal", "Bank/Finance"]),
+                "thread_id": thread_id,
+                "attachments": attachments
+            }
+            for msg_id, (sender, subject, body, thread_id, attachments) in fetched.items()
+        ])
+
+
+def run(args):
+    from email_summarizer.email_summarizer import get_email_details
+    from database.schema import init_db
+    from database.helpers import save_email, assign_smart_thread_id
+
+    init_db()
+    gmail = FakeGmail(args.mailbox, latency=args.gmail_latency, seed=1)
+    seed_mailbox(gmail, USER)
+
+    results = {}
+    wanted = set(args.scenarios)
+    rng = random.Random(7)
+
+    if "get_email_details" in wanted:
+        ids = [gmail.message_id(rng.randrange(gmail.count)) for _ in range(args.ops)]
+        results["get_email_details"] = measure(
+            lambda i: get_email_details(gmail, ids[i]), args.ops, memory=args.memory
+        )
+
+    if "save_email" in wanted:
+        source = FakeGmail(args.ops, seed=2)
+
+        def save(i):
+            sender, subject, body, thread_id, attachments = get_email_details(source, source.message_id(i))
+            save_email(source.message_id(i), USER, sender, subject, body, body[:200], "Medium", thread_id, attachments)
+
+        results["save_email"] = measure(save, args.ops, memory=args.memory)
+
+    if "assign_smart_thread_id" in wanted:
+        subjects = [gmail.build_message(rng.randrange(gmail.count))["payload"]["headers"][2]["value"] for _ in range(args.ops)]
+        subjects = [s if n % 2 else f"{s} {rng.choice(WORDS)}" for n, s in enumerate(subjects)]
+        results["assign_smart_thread_id"] = measure(
+            lambda i: assign_smart_thread_id(USER, subjects[i]), args.ops, memory=args.memory
+        )
+
+    if wanted & {"search", "threads"}:
+        import scheduler
+        # The app starts the background scheduler on import; keep it out of the numbers
+        scheduler.start_scheduler = lambda: None
+        import server
+        from fastapi.testclient import TestClient
+
+        client = TestClient(server.app)
+
+        if "search" in wanted:
+            queries = [" ".join(rng.choices(WORDS, k=rng.randint(1, 2))) for _ in range(args.ops)]
+
+            def search(i):
+                response = client.get("/search", params={"user_email": USER, "q": queries[i]})
+                response.raise_for_status()
+
+            results["search"] = measure(search, args.ops, memory=args.memory)
+
+        if "threads" in wanted:
+            def threads(i):
+                mode = "subject" if i % 2 else "category"
+                response = client.get("/threads", params={"user_email": USER, "mode": mode, "limit": 20})
+                response.raise_for_status()
+
+            results["threads"] = measure(threads, args.ops, memory=args.memory)
+
+    if "auto_fetch_emails" in wanted:
+        import scheduler
+        from database.helpers import save_emails
+
+        mailboxes = {
+            f"user{n}@example.com": FakeGmail(args.user_mailbox, latency=args.gmail_latency, seed=100 + n)
+            for n in range(args.users)
+        }
+        for user_email in mailboxes:
+            # The scheduler only visits users that already have stored mail
+            save_emails(user_email, [{"email_id": f"seed-{user_email}", "subject": "welcome", "body": ""}])
+        scheduler.authenticate_gmail = lambda user_email: mailboxes.get(user_email, gmail)
+
+        # First cycle is a full resync of every mailbox; time the incremental ones
+        scheduler.auto_fetch_emails()
+
+        def cycle(i):
+            for mailbox in mailboxes.values():
+                mailbox.add_messages(args.new_per_cycle)
+            scheduler.auto_fetch_emails()
+
+        results["auto_fetch_emails"] = measure(
+            cycle, args.cycles, items_per_op=args.users * args.new_per_cycle, memory=args.memory
+        )
+
+    return results
+
+
+def print_results(results):
+    print(f"{'scenario':>24} {'ops':>6} {'items/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak MB':>8}")
+    for name, r in results.items():
+        print(
+            f"{name:>24} {r['ops']:>6} {r['items_per_s']:>10,.1f} {r['p50_ms']:>9.2f}"
+            f" {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['peak_mb']:>8.2f}"
+        )
+
+
+def compare(results, baseline, threshold):
+    """Print changes against a stored run; returns the scenarios that regressed."""
+    regressed = []
+    print(f"\n{'scenario':>24} {'items/s':>10} {'p99':>10} {'peak':>10}")
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name:>24}   (not in baseline)")
+            continue
+
+        def change(key):
+            return (r[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+
+        throughput, p99, peak = change("items_per_s"), change("p99_ms"), change("peak_mb")
+        worse = throughput < -threshold or p99 > threshold
+        if worse:
+            regressed.append(name)
+        print(
+            f"{name:>24} {throughput:>+9.1f}% {p99:>+9.1f}% {peak:>+9.1f}%"
+            f"{'   REGRESSION' if worse else ''}"
+        )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--mailbox", type=int, default=2000, help="messages in the main fake mailbox")
+    parser.add_argument("--ops", type=int, default=300, help="operations per scenario")
+    parser.add_argument("--users", type=int, default=4, help="mailboxes in the auto_fetch_emails scenario")
+    parser.add_argument("--user-mailbox", type=int, default=100)
+    parser.add_argument("--new-per-cycle", type=int, default=20)
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--gmail-latency", type=float, default=0.0)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip tracemalloc (faster)")
+    parser.add_argument("--save-baseline", metavar="PATH", nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--compare", metavar="PATH", nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold, percent")
+    args = parser.parse_args()
+    # The run happens in a temp dir; resolve baseline paths against the caller's cwd
+    args.save_baseline = args.save_baseline and os.path.abspath(args.save_baseline)
+    args.compare = args.compare and os.path.abspath(args.compare)
+
+    tmp = tempfile.mkdtemp()
+    llm = start_fake_llm(args.llm_latency)
+
+    # Set before the app is imported so every client and engine picks them up
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+    os.environ["OPENROUTER_BASE_URL"] = llm.base_url
+    os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+    os.environ["LLM_CACHE_PATH"] = f"{tmp}/llm_cache.db"
+    os.environ["LOCAL_MODEL_PATH"] = f"{tmp}/local_classifier.pkl"
+    os.environ["SENDER_RULES_PATH"] = f"{tmp}/sender_rules.json"
+    os.environ.setdefault("LLM_CACHE_ENABLED", "0")
+    os.environ.setdefault("STRUCTURED_LOGS", "0")
+    os.chdir(tmp)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    results = run(args)
+    print(f"\nmailbox: {args.mailbox}  ops: {args.ops}  llm calls: {llm.calls}  python {platform.python_version()}")
+    print_results(results)
+
+    meta = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "mailbox": args.mailbox,
+        "ops": args.ops,
+        "llm_latency": args.llm_latency,
+        "gmail_latency": args.gmail_latency,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        differs = {k: (v, meta[k]) for k, v in baseline.get("meta", {}).items() if meta.get(k) != v}
+        if differs:
+            print(f"\n⚠️ Baseline taken with a different setup (baseline, now): {differs}")
+        regressed = compare(results, baseline["results"], args.threshold)
+        if regressed:
+            print(f"\n{len(regressed)} scenario(s) regressed by more than {args.threshold:.0f}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
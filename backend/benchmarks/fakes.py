@@ -0,0 +1,355 @@
+"""Stand-ins for external services, for benchmarks.
+
+FakeGmail mimics the googleapiclient Gmail resource the app uses
+(messages list/get, batch requests, history, profile, attachments) over a
+synthetic mailbox of multipart messages, with injectable latency and
+429 errors.
+
+start_fake_llm() serves an OpenAI-compatible /chat/completions endpoint
+that answers the summarizer's prompts (categorization, chunk summaries,
+merges) with well-formed output after an injectable delay.
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from benchmarks.bench_db_concurrency import WORDS, VOCAB
+
+SENDERS = [
+    "Team Updates <updates@work.example.com>",
+    "HDFC Bank <alerts@hdfcbank.example.com>",
+    "Weekly Digest <newsletter@news.example.com>",
+    "Account Security <security@accounts.example.com>",
+    "Placement Cell <placements@vit.edu>",
+    "Alex <alex@gmail.example.com>",
+    "Travel Desk <no-reply@travel.example.com>",
+    "Billing <billing@utility.example.com>",
+]
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b'{"error": "fake"}')
+
+
+def _strip_body_data(part):
+    part.get("body", {}).pop("data", None)
+    for child in part.get("parts") or []:
+        _strip_body_data(child)
+
+
+class _Request:
+    def __init__(self, gmail, fn):
+        self.gmail = gmail
+        self.fn = fn
+
+    def execute(self):
+        self.gmail._call(self.gmail.latency)
+        return self.fn()
+
+
+class _Batch:
+    def __init__(self, gmail, callback):
+        self.gmail = gmail
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        # One round trip for the whole batch, then one callback per item
+        self.gmail._call(self.gmail.latency)
+        for request_id, request in self.requests:
+            try:
+                if self.gmail._rng.random() < self.gmail.error_rate:
+                    raise _http_error(429)
+                response = request.fn()
+            except HttpError as e:
+                self.callback(request_id, None, e)
+                continue
+            self.callback(request_id, response, None)
+
+
+class FakeGmail:
+    """In-memory Gmail API with a synthetic mailbox; message i is generated deterministically."""
+
+    def __init__(self, messages=1000, latency=0.0, error_rate=0.0, seed=0,
+                 paragraphs=12, attachment_share=0.3):
+        self.count = messages
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.paragraphs = paragraphs
+        self.attachment_share = attachment_share
+        self.calls = 0
+        self.history_id = 1000
+        self._history = []   # [(history_id, [message index])]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # --- mailbox -----------------------------------------------------------
+    def message_id(self, i):
+        return f"{self.seed:04x}{i:012x}"
+
+    def _index(self, msg_id):
+        i = int(msg_id[4:], 16)
+        if msg_id[:4] != f"{self.seed:04x}" or i >= self.count:
+            raise _http_error(404)
+        return i
+
+    def add_messages(self, n):
+        """Deliver n new messages; they show up in list and in history."""
+        with self._lock:
+            start = self.count
+            self.count += n
+            self.history_id += 1
+            self._history.append((self.history_id, list(range(start, self.count))))
+
+    def build_message(self, i):
+        rng = random.Random(self.seed * 1_000_003 + i)
+        sender = rng.choice(SENDERS)
+        subject = " ".join(rng.choices(VOCAB, k=rng.randint(3, 7))).capitalize()
+        if rng.random() < 0.3:
+            subject = "Re: " + subject
+        text = "\n\n".join(
+            ". ".join(" ".join(rng.choices(VOCAB, k=rng.randint(6, 14))) for _ in range(4)) + "."
+            for _ in range(self.paragraphs)
+        )
+        html = "<html><body>" + "".join(f"<p>{p}</p>" for p in text.split("\n\n")) + "</body></html>"
+
+        parts = [{
+            "partId": "0",
+            "mimeType": "multipart/alternative",
+            "filename": "",
+            "headers": [{"name": "Content-Type", "value": "multipart/alternative; boundary=alt"}],
+            "body": {"size": 0},
+            "parts": [
+                {
+                    "partId": "0.0",
+                    "mimeType": "text/plain",
+                    "filename": "",
+                    "headers": [{"name": "Content-Type", "value": "text/plain; charset=UTF-8"}],
+                    "body": {"size": len(text), "data": _b64(text.encode())}
+                },
+                {
+                    "partId": "0.1",
+                    "mimeType": "text/html",
+                    "filename": "",
+                    "headers": [{"name": "Content-Type", "value": "text/html; charset=UTF-8"}],
+                    "body": {"size": len(html), "data": _b64(html.encode())}
+                }
+            ]
+        }]
+        if rng.random() < self.attachment_share:
+            size = rng.randint(10_000, 500_000)
+            parts.append({
+                "partId": "1",
+                "mimeType": "application/pdf",
+                "filename": f"{rng.choice(WORDS)}-{i}.pdf",
+                "headers": [{"name": "Content-Type", "value": "application/pdf"}],
+                "body": {"size": size, "attachmentId": f"att-{i}"}
+            })
+
+        msg_id = self.message_id(i)
+        return {
+            "id": msg_id,
+            "threadId": self.message_id(i - i % 3),
+            "labelIds": ["INBOX"],
+            "snippet": text[:120],
+            "sizeEstimate": len(text) + len(html),
+            "internalDate": str(1_700_000_000_000 + i * 1000),
+            "payload": {
+                "partId": "",
+                "mimeType": "multipart/mixed",
+                "filename": "",
+                "headers": [
+                    {"name": "From", "value": sender},
+                    {"name": "To", "value": "me@example.com"},
+                    {"name": "Subject", "value": subject},
+                    {"name": "Content-Type", "value": "multipart/mixed; boundary=mixed"}
+                ],
+                "body": {"size": 0},
+                "parts": parts
+            }
+        }
+
+    def attachment_bytes(self, i, size):
+        rng = random.Random(self.seed * 7_000_003 + i)
+        return rng.randbytes(size)
+
+    def _call(self, latency):
+        with self._lock:
+            self.calls += 1
+        if latency:
+            time.sleep(latency)
+
+    # --- googleapiclient surface --------------------------------------------
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return _History(self)
+
+    def attachments(self):
+        return _Attachments(self)
+
+    def getProfile(self, userId="me"):
+        return _Request(self, lambda: {"emailAddress": userId, "historyId": str(self.history_id)})
+
+    def list(self, userId="me", q=None, maxResults=100, pageToken=None, **kwargs):
+        def run():
+            # Newest first, like Gmail
+            offset = int(pageToken or 0)
+            end = min(self.count, offset + maxResults)
+            result = {
+                "messages": [
+                    {"id": self.message_id(i), "threadId": self.message_id(i - i % 3)}
+                    for i in range(self.count - 1 - offset, self.count - 1 - end, -1)
+                ],
+                "resultSizeEstimate": self.count
+            }
+            if end < self.count:
+                result["nextPageToken"] = str(end)
+            return result
+        return _Request(self, run)
+
+    def get(self, userId="me", id=None, format="full", fields=None, **kwargs):
+        def run():
+            msg = self.build_message(self._index(id))
+            if fields and "data" not in fields:
+                _strip_body_data(msg["payload"])
+            return msg
+        return _Request(self, run)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+
+class _History:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId="me", startHistoryId=None, historyTypes=None, pageToken=None, **kwargs):
+        gmail = self.gmail
+
+        def run():
+            start = int(startHistoryId)
+            if start < 1000:
+                raise _http_error(404)
+            records = [
+                {
+                    "id": str(history_id),
+                    "messagesAdded": [
+                        {"message": {"id": gmail.message_id(i), "threadId": gmail.message_id(i - i % 3), "labelIds": ["INBOX"]}}
+                        for i in indexes
+                    ]
+                }
+                for history_id, indexes in gmail._history if history_id > start
+            ]
+            return {"history": records, "historyId": str(gmail.history_id)}
+        return _Request(gmail, run)
+
+
+class _Attachments:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def get(self, userId="me", messageId=None, id=None, **kwargs):
+        gmail = self.gmail
+
+        def run():
+            i = gmail._index(messageId)
+            msg = gmail.build_message(i)
+            for part in msg["payload"]["parts"]:
+                if part["body"].get("attachmentId") == id:
+                    size = part["body"]["size"]
+                    return {"size": size, "data": _b64(gmail.attachment_bytes(i, size))}
+            raise _http_error(404)
+        return _Request(gmail, run)
+
+_IDS = re.compile(r'\{"id": "([^"]+)"')
+
+
+def _fake_completion(prompt):
+    ids = [i for i in _IDS.findall(prompt) if i != "email id"]
+    if '"priorities"' in prompt:
+        return json.dumps({
+            "summary": f"{len(ids)} emails about work and updates",
+            "priorities": [{"id": i, "priority": ("High", "Medium", "Low")[n % 3]} for n, i in enumerate(ids)]
+        })
+    if "Return a JSON array ONLY" in prompt:
+        return json.dumps([{"id": i, "category": "Work"} for i in ids])
+    if "Part 1:" in prompt:
+        return "Overall: work updates, a few alerts and newsletters."
+    return "Work"
+
+
+class FakeLLM:
+    """Threaded fake LLM server; latency (seconds) can be changed while running."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                prompt = body["messages"][0]["content"]
+                with fake._lock:
+                    fake.calls += 1
+                    fake.prompt_chars += len(prompt)
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                data = json.dumps({
+                    "id": "fake",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": _fake_completion(prompt)}
+                    }],
+                    "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 20, "total_tokens": len(prompt) // 4 + 20}
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def start_fake_llm(latency=0.0):
+    return FakeLLM(latency)
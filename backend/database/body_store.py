@@ -0,0 +1,17 @@
+# database/body_store.py
+import os
+import zlib
+
+# zlib level for stored email bodies (1 = fastest, 9 = smallest)
+BODY_COMPRESSION_LEVEL = int(os.getenv("BODY_COMPRESSION_LEVEL", "6"))
+
+
+def compress_body(text):
+    """UTF-8 encode and zlib-compress body text for the email_bodies table."""
+    return zlib.compress(text.encode("utf-8"), BODY_COMPRESSION_LEVEL)
+
+
+def decompress_body(data):
+    if data is None:
+        return None
+    return zlib.decompress(data).decode("utf-8")
@@ -1,17 +1,126 @@
 # database/database.py
-from sqlalchemy import create_engine
+import os
+import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
+from utils.metrics import REGISTRY
+from database.body_store import decompress_body
 
-# SQLite DB file (same as before)
-DATABASE_URL = "sqlite:///./feedback.db"
+# SQLite DB file by default; any SQLAlchemy URL works (e.g. postgresql+psycopg2://...)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./feedback.db")
 
-# Engine setup
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
+# SQLite tuning (web workers and the scheduler write to the same file)
+SQLITE_TUNING = os.getenv("SQLITE_TUNING", "1") == "1"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Connection pool (also bounds the server's concurrent DB endpoints)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "mail_db_query_seconds", "Time per SQL statement.", ["operation"]
+)
+DB_SESSION_SECONDS = REGISTRY.histogram(
+    "mail_db_session_seconds", "Wall time of each session transaction, BEGIN to commit/rollback."
+)
+DB_SESSION_QUERY_SECONDS = REGISTRY.histogram(
+    "mail_db_session_query_seconds", "Time spent inside SQL statements per session transaction."
 )
+_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "CREATE", "PRAGMA"}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_started"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    DB_QUERY_SECONDS.observe(seconds, operation=operation if operation in _OPERATIONS else "OTHER")
+    conn.info["query_seconds"] = conn.info.get("query_seconds", 0.0) + seconds
+
+
+def _after_begin(session, transaction, connection):
+    if "db_started" not in session.info:
+        session.info["db_started"] = time.perf_counter()
+        # The connection may already be closed when the transaction ends; keep its info dict
+        session.info["db_connection_info"] = connection.info
+        connection.info["query_seconds"] = 0.0
+
+
+def _after_transaction_end(session, transaction):
+    if transaction.parent is not None or "db_started" not in session.info:
+        return
+    DB_SESSION_SECONDS.observe(time.perf_counter() - session.info.pop("db_started"))
+    connection_info = session.info.pop("db_connection_info")
+    DB_SESSION_QUERY_SECONDS.observe(connection_info.get("query_seconds", 0.0))
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run alongside the single writer instead of blocking on it
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # Safe with WAL: only the last commits can be lost on power failure, never corrupted
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    # Lets the FTS triggers index bodies that are stored compressed
+    dbapi_connection.create_function("inflate_body", 1, decompress_body, deterministic=True)
+
+
+def create_db_engine(url=DATABASE_URL):
+    """Engine for the configured database, tuned per backend and timed per statement."""
+    if url.startswith("sqlite"):
+        # In-memory databases use a single-connection pool that takes no sizing
+        pool_args = {} if ":memory:" in url else {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT
+        }
+        engine = create_engine(
+            url,
+            connect_args={
+                "check_same_thread": False,
+                "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000
+            },
+            **pool_args
+        )
+        event.listen(engine, "connect", _register_sqlite_functions)
+        if SQLITE_TUNING:
+            event.listen(engine, "connect", _apply_sqlite_pragmas)
+    else:
+        engine = create_engine(
+            url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True
+        )
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+# Engine setup
+engine = create_db_engine()
 
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+event.listen(SessionLocal, "after_begin", _after_begin)
+event.listen(SessionLocal, "after_transaction_end", _after_transaction_end)
 
 # Base for ORM models
 Base = declarative_base()
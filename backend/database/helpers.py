@@ -1,24 +1,78 @@
 from database.database import SessionLocal
-from database.models import Email, EmailAttachment
-from utils.subject_similarity import subject_similarity
+from database.models import Email, EmailBody, EmailAttachment, SyncState, Feedback, SmartThreadCentroid, SmartThreadVocabulary
+from database.body_store import compress_body, decompress_body
+from sqlalchemy import update, bindparam, func, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from utils.subject_index import SubjectIdf, ThreadCentroidIndex, normalize_subject
+from utils.subject_similarity import group_similar_subjects
+from utils.metrics import stage
 from email_summarizer.email_summarizer import smart_categorize_email
+from email_summarizer.local_classifier import LocalClassifier, set_local_classifier
+from collections import Counter
+import json
 import os
+import threading
 
-def assign_smart_thread_id(user_email, subject):
-    db = SessionLocal()
+# Similarity (0-100) above which a subject joins a smart thread
+SMART_THREAD_THRESHOLD = int(os.getenv("SMART_THREAD_THRESHOLD", "85"))
 
-    emails = db.query(Email).filter(Email.user_email == user_email).all()
+# Per-user smart thread centroids, built lazily from the DB and kept in memory
+_subject_indexes = {}
+_subject_indexes_lock = threading.Lock()
 
-    best_match = None
-    best_score = 0
 
-    for email in emails:
-        score = subject_similarity(subject, email.subject)
-        if score > 85 and score > best_score:
-            best_match = email.smart_thread_id
-            best_score = score
+def get_subject_index(user_email):
+    """Return the user's thread centroid index, loading it from the DB on first use.
 
-    db.close()
+    Starts from the centroids and idf table stored by the last re-clustering
+    run and folds in only the emails saved since. Without them, the idf is
+    fitted over the whole mailbox and every email is folded into its current
+    smart thread. The idf then stays fixed until the next re-clustering, so
+    stored and newly added centroids are weighted alike.
+    """
+    with _subject_indexes_lock:
+        index = _subject_indexes.get(user_email)
+        if index is not None:
+            return index
+
+        db = SessionLocal()
+        try:
+            vocabulary = db.get(SmartThreadVocabulary, user_email)
+            centroids = db.query(SmartThreadCentroid).filter(
+                SmartThreadCentroid.user_email == user_email
+            ).all() if vocabulary else []
+            query = db.query(Email.subject, Email.smart_thread_id).filter(
+                Email.user_email == user_email
+            )
+            if centroids:
+                reclustered_at = db.query(func.max(SmartThreadCentroid.updated_at)).filter(
+                    SmartThreadCentroid.user_email == user_email
+                ).scalar_subquery()
+                # Strictly after: emails from the re-clustering's own second are already in the centroids
+                query = query.filter(Email.timestamp > reclustered_at)
+            rows = query.all()
+        finally:
+            db.close()
+
+        if centroids:
+            idf = SubjectIdf(json.loads(vocabulary.document_frequencies), vocabulary.documents)
+        else:
+            idf = SubjectIdf.fit([subject for subject, _ in rows])
+        index = ThreadCentroidIndex(idf)
+        for centroid in centroids:
+            index.set_centroid(centroid.smart_thread_id, json.loads(centroid.terms), centroid.size)
+        for subject, smart_thread_id in rows:
+            index.add(subject, smart_thread_id)
+
+        _subject_indexes[user_email] = index
+        return index
+
+
+def assign_smart_thread_id(user_email, subject):
+    best_match, _ = get_subject_index(user_email).best_match(
+        subject, threshold=SMART_THREAD_THRESHOLD
+    )
 
     # If no match found → create new smart thread id
     if not best_match:
@@ -26,40 +80,395 @@ def assign_smart_thread_id(user_email, subject):
 
     return best_match
 
-def save_email(email_id, user_email, sender, subject, body, summary, priority, thread_id, attachments):
+def recluster_smart_threads(user_email, threshold=SMART_THREAD_THRESHOLD):
+    """Re-cluster a user's whole mailbox into smart threads and store the centroids.
+
+    Online threading is greedy and depends on arrival order. This fits one
+    idf table over every subject, merges pairs above ``threshold`` with
+    union-find, and rewrites ``smart_thread_id`` in bulk. The idf table is
+    stored with the centroids so online threading scores against the same
+    weights.
+    Each cluster keeps the id most of its emails already had, so threads
+    stay stable across runs. Returns counts of emails, threads and
+    reassigned emails.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.query(Email.email_id, Email.subject, Email.smart_thread_id).filter(
+            Email.user_email == user_email
+        ).order_by(Email.timestamp, Email.email_id).all()
+
+        with stage("recluster", emails=len(rows)) as info:
+            idf = SubjectIdf.fit([subject for _, subject, _ in rows])
+
+            # Identical normalized subjects always share a thread, so cluster each once
+            row_keys = [" ".join(normalize_subject(subject)) for _, subject, _ in rows]
+            members = {}
+            for i, key in enumerate(row_keys):
+                if key:
+                    members.setdefault(key, []).append(i)
+
+            clusters = {}
+            for key, label in zip(members, group_similar_subjects(list(members), threshold, idf=idf)):
+                clusters.setdefault(label, []).extend(members[key])
+
+            # Subjects with no tokens never join a thread; keep their ids out of reach
+            taken = {rows[i].smart_thread_id for i, key in enumerate(row_keys) if not key}
+            assignments = {}
+            centroids = {}
+            for cluster in sorted(clusters.values(), key=len, reverse=True):
+                # Ties go to the id of the earliest email
+                votes = Counter(rows[i].smart_thread_id for i in sorted(cluster) if rows[i].smart_thread_id)
+                smart_thread_id = next((t for t, _ in votes.most_common() if t not in taken), None)
+                if not smart_thread_id:
+                    smart_thread_id = f"smart-{os.urandom(4).hex()}"
+                taken.add(smart_thread_id)
+
+                weights = {}
+                for i in cluster:
+                    assignments[rows[i].email_id] = smart_thread_id
+                    for token, weight in idf.unit_vector(rows[i].subject).items():
+                        weights[token] = weights.get(token, 0.0) + weight
+                centroids[smart_thread_id] = (weights, len(cluster))
+
+            changed = [
+                {"b_email_id": email_id, "b_smart_thread_id": assignments[email_id]}
+                for email_id, _, smart_thread_id in rows
+                if email_id in assignments and assignments[email_id] != smart_thread_id
+            ]
+            if changed:
+                stmt = update(Email.__table__).where(
+                    Email.__table__.c.email_id == bindparam("b_email_id")
+                ).values(smart_thread_id=bindparam("b_smart_thread_id"))
+                db.execute(stmt, changed)
+
+            db.query(SmartThreadCentroid).filter(
+                SmartThreadCentroid.user_email == user_email
+            ).delete(synchronize_session=False)
+            db.merge(SmartThreadVocabulary(
+                user_email=user_email,
+                document_frequencies=json.dumps(idf.document_frequencies),
+                documents=idf.documents,
+                updated_at=func.now()
+            ))
+            if centroids:
+                db.execute(SmartThreadCentroid.__table__.insert(), [
+                    {
+                        "user_email": user_email,
+                        "smart_thread_id": smart_thread_id,
+                        "terms": json.dumps(weights),
+                        "size": size
+                    }
+                    for smart_thread_id, (weights, size) in centroids.items()
+                ])
+            db.commit()
+
+            info.update(threads=len(centroids), changed=len(changed))
+    finally:
+        db.close()
+
+    index = ThreadCentroidIndex(idf)
+    for smart_thread_id, (weights, size) in centroids.items():
+        index.set_centroid(smart_thread_id, weights, size)
+    with _subject_indexes_lock:
+        _subject_indexes[user_email] = index
+
+    return {"emails": len(rows), "threads": len(centroids), "changed": len(changed)}
+
+
+def get_known_emails(email_ids, chunk_size=500):
+    """Look up already-stored emails with bulk IN queries.
+
+    Returns {email_id: {"email_id", "from", "subject", "summary"}} for the
+    IDs that exist, so callers can skip fetching and processing them.
+    """
+    email_ids = list(dict.fromkeys(email_ids))
+    known = {}
+    if not email_ids:
+        return known
+
+    db = SessionLocal()
+    for start in range(0, len(email_ids), chunk_size):
+        rows = db.query(Email.email_id, Email.sender, Email.subject, Email.summary).filter(
+            Email.email_id.in_(email_ids[start:start + chunk_size])
+        ).all()
+        for email_id, sender, subject, summary in rows:
+            known[email_id] = {
+                "email_id": email_id,
+                "from": sender,
+                "subject": subject,
+                "summary": summary
+            }
+    db.close()
+    return known
+
+def save_email(email_id, user_email, sender, subject, body, summary, priority, thread_id, attachments, category=None):
+    if category is None:
+        # Avoid categorizing duplicates
+        if get_known_emails([email_id]):
+            return
+        category, category_source = smart_categorize_email(subject, body, sender)
+    else:
+        category_source = None
+
+    save_emails(user_email, [{
+        "email_id": email_id,
+        "sender": sender,
+        "subject": subject,
+        "body": body,
+        "summary": summary,
+        "priority": priority,
+        "category": category,
+        "category_source": category_source,
+        "thread_id": thread_id,
+        "attachments": attachments
+    }])
+
+
+def _insert_for(db):
+    """Dialect insert construct that supports ON CONFLICT DO NOTHING."""
+    if db.get_bind().dialect.name == "postgresql":
+        return pg_insert
+    return sqlite_insert
+
+
+def save_emails(user_email, emails, chunk_size=200):
+    """Persist many parsed emails and their attachments in one transaction.
+
+    emails are dicts with email_id / sender / subject / body / summary /
+    priority / category / thread_id / attachments, plus optional
+    category_source / priority_source (see LABEL_SOURCES; "default" if
+    missing). Rows are written with
+    INSERT ... ON CONFLICT DO NOTHING, so duplicates (including ones a
+    concurrent writer just inserted) are skipped, and bodies and attachments
+    are only written for rows that were actually inserted. Returns the
+    inserted IDs.
+    """
+    if not emails:
+        return set()
+
+    # Thread against the stored mailbox and against earlier emails in this batch
+    with stage("thread_assign", emails=len(emails)):
+        index = get_subject_index(user_email)
+        batch_index = ThreadCentroidIndex(index.idf)
+        rows = []
+        bodies = {}
+        for e in emails:
+            stored_match, stored_score = index.best_match(e["subject"], threshold=SMART_THREAD_THRESHOLD)
+            batch_match, batch_score = batch_index.best_match(e["subject"], threshold=SMART_THREAD_THRESHOLD)
+            smart_thread_id = stored_match if stored_score >= batch_score else batch_match
+            if not smart_thread_id:
+                smart_thread_id = f"smart-{os.urandom(4).hex()}"
+            batch_index.add(e["subject"], smart_thread_id)
+
+            rows.append({
+                "email_id": e["email_id"],
+                "user_email": user_email,
+                "sender": e.get("sender"),
+                "subject": e.get("subject"),
+                "summary": e.get("summary"),
+                "priority": e.get("priority") or "Medium",
+                "category": e.get("category") or "Uncategorized",
+                "category_source": e.get("category_source") or "default",
+                "priority_source": e.get("priority_source") or "default",
+                "thread_id": e.get("thread_id"),
+                "smart_thread_id": smart_thread_id
+            })
+            # Compressed here rather than inside the write transaction. A snippet-only
+            # email gets a row even when its snippet is empty, so the backfill finds it
+            if e.get("body") or e.get("snippet_only"):
+                bodies[e["email_id"]] = (compress_body(e.get("body") or ""), bool(e.get("snippet_only")))
+
+    db = SessionLocal()
+    try:
+        with stage("db_write", emails=len(rows)) as info:
+            insert = _insert_for(db)
+            inserted = set()
+            for start in range(0, len(rows), chunk_size):
+                stmt = insert(Email).values(rows[start:start + chunk_size]).on_conflict_do_nothing(
+                    index_elements=["email_id"]
+                ).returning(Email.email_id)
+                inserted.update(db.execute(stmt).scalars())
+
+            body_rows = [
+                {"email_id": email_id, "data": data, "is_snippet": is_snippet}
+                for email_id, (data, is_snippet) in bodies.items() if email_id in inserted
+            ]
+            if body_rows:
+                db.execute(insert(EmailBody), body_rows)
+
+            attachment_rows = [
+                {
+                    "email_id": e["email_id"],
+                    "filename": att["filename"],
+                    "mime_type": att["mime_type"],
+                    "size": att["size"],
+                    "attachment_id": att["attachment_id"]
+                }
+                for e in emails if e["email_id"] in inserted
+                for att in e.get("attachments") or []
+            ]
+            if attachment_rows:
+                db.execute(insert(EmailAttachment), attachment_rows)
+
+            db.commit()
+            info["inserted"] = len(inserted)
+    finally:
+        db.close()
+
+    for row in rows:
+        if row["email_id"] in inserted:
+            index.add(row["subject"], row["smart_thread_id"])
+
+    return inserted
+
+
+def get_snippet_body_ids(user_email, after=None, limit=200, since=None):
+    """IDs of the user's emails whose stored body is still the Gmail snippet, in ID order.
+
+    With ``since``, only emails saved at or after that time.
+    """
     db = SessionLocal()
+    try:
+        query = db.query(EmailBody.email_id).join(Email, Email.email_id == EmailBody.email_id).filter(
+            Email.user_email == user_email,
+            EmailBody.is_snippet == True
+        )
+        if after:
+            query = query.filter(EmailBody.email_id > after)
+        if since is not None:
+            query = query.filter(Email.timestamp >= since)
+        return [email_id for (email_id,) in query.order_by(EmailBody.email_id).limit(limit)]
+    finally:
+        db.close()
 
-    # Avoid duplicates
-    existing = db.query(Email).filter(Email.email_id == email_id).first()
-    if existing:
+
+def replace_snippet_bodies(bodies):
+    """Store fetched full bodies ({email_id: text}) over their snippets in one executemany."""
+    if not bodies:
+        return
+
+    table = EmailBody.__table__
+    stmt = update(table).where(
+        table.c.email_id == bindparam("b_email_id")
+    ).values(data=bindparam("b_data"), is_snippet=False)
+
+    db = SessionLocal()
+    try:
+        db.execute(stmt, [
+            {"b_email_id": email_id, "b_data": compress_body(body or "")}
+            for email_id, body in bodies.items()
+        ])
+        db.commit()
+    finally:
         db.close()
+
+
+def update_email_priorities(priorities, source="llm"):
+    """Set priority for many emails ({email_id: priority}) in one executemany."""
+    if not priorities:
         return
-    
-    category = smart_categorize_email(subject, body, sender)
-    smart_thread_id = assign_smart_thread_id(user_email, subject)
-
-    new_email = Email(
-        email_id=email_id,
-        user_email=user_email,
-        sender=sender,
-        subject=subject,
-        body=body,
-        summary=summary,
-        priority=priority,
-        category=category,
-        thread_id=thread_id,
-        smart_thread_id=smart_thread_id
-    )
 
-    for att in attachments:
-        db.add(EmailAttachment(
-            email_id=email_id,
-            filename=att["filename"],
-            mime_type=att["mime_type"],
-            size=att["size"],
-            attachment_id=att["attachment_id"]
-        ))
+    stmt = update(Email.__table__).where(
+        Email.__table__.c.email_id == bindparam("b_email_id")
+    ).values(priority=bindparam("b_priority"), priority_source=source)
+
+    db = SessionLocal()
+    try:
+        db.execute(stmt, [
+            {"b_email_id": email_id, "b_priority": priority}
+            for email_id, priority in priorities.items()
+        ])
+        db.commit()
+    finally:
+        db.close()
+
 
-    db.add(new_email)
+def get_history_id(user_email):
+    db = SessionLocal()
+    state = db.query(SyncState).filter(SyncState.user_email == user_email).first()
+    history_id = state.history_id if state else None
+    db.close()
+    return history_id
+
+
+def set_history_id(user_email, history_id, failed_ids=None):
+    """Store the synced historyId and the listed messages that still need fetching."""
+    failed = json.dumps(failed_ids) if failed_ids else None
+    db = SessionLocal()
+    state = db.query(SyncState).filter(SyncState.user_email == user_email).first()
+    if state:
+        state.history_id = history_id
+        state.failed_ids = failed
+    else:
+        db.add(SyncState(user_email=user_email, history_id=history_id, failed_ids=failed))
     db.commit()
-    db.close()
\ No newline at end of file
+    db.close()
+
+
+def get_failed_message_ids(user_email):
+    """{message id: failed attempts} for messages earlier syncs listed but could not save."""
+    db = SessionLocal()
+    state = db.query(SyncState).filter(SyncState.user_email == user_email).first()
+    failed = state.failed_ids if state else None
+    db.close()
+    return json.loads(failed) if failed else {}
+
+
+# Human feedback counts more than labels the LLM assigned
+FEEDBACK_WEIGHT = 5.0
+
+
+def train_local_classifier(max_rows=50000):
+    """Retrain the local category/priority model from LLM-assigned labels and feedback.
+
+    Labels from sender rules, the local model itself and placeholder
+    defaults are not used, so the model never learns from its own output.
+    """
+    db = SessionLocal()
+    feedback_ids = db.query(Feedback.email_id)
+    rows = db.query(
+        Email.email_id, Email.sender, Email.subject, EmailBody.data,
+        Email.category, Email.category_source, Email.priority, Email.priority_source
+    ).outerjoin(EmailBody, EmailBody.email_id == Email.email_id).filter(
+        or_(
+            Email.category_source == "llm",
+            Email.priority_source == "llm",
+            Email.email_id.in_(feedback_ids)
+        )
+    ).order_by(Email.timestamp.desc()).limit(max_rows).all()
+    feedback = db.query(Feedback.email_id, Feedback.priority, Feedback.is_correct).order_by(
+        Feedback.timestamp
+    ).all()
+    db.close()
+
+    samples = {}
+    stored_priorities = {}
+    for email_id, sender, subject, body, category, category_source, priority, priority_source in rows:
+        stored_priorities[email_id] = priority
+        samples[email_id] = {
+            "sender": sender,
+            "subject": subject,
+            "body": decompress_body(body),
+            "category": category if category_source == "llm" and category != "Uncategorized" else None,
+            "priority": priority if priority_source == "llm" else None,
+            "weight": 1.0
+        }
+
+    # Latest feedback per email wins: a confirmed priority is kept with more
+    # weight, a rejected one is dropped unless the user supplied a different one
+    for email_id, priority, is_correct in feedback:
+        sample = samples.get(email_id)
+        if sample is None:
+            continue
+        if is_correct or priority != stored_priorities[email_id]:
+            sample["priority"] = priority
+            sample["weight"] = FEEDBACK_WEIGHT
+        else:
+            sample["priority"] = None
+
+    model = LocalClassifier()
+    trained = model.train(list(samples.values()))
+    if trained:
+        set_local_classifier(model)
+    return trained
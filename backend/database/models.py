@@ -1,7 +1,8 @@
 # database/models.py
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, func, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, LargeBinary, func, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database.database import Base
+from database.body_store import decompress_body
 
 class Feedback(Base):
     """ORM model for feedback records."""
@@ -22,15 +23,47 @@ class Email(Base):
     user_email = Column(String, nullable=False, index=True)
     sender = Column(String, nullable=True)
     subject = Column(String, nullable=True)
-    body = Column(String, nullable=True)
     summary = Column(String, nullable=True)
     priority = Column(String, default="Medium")
     category = Column(String, default="Uncategorized")
+    # Label provenance: llm / rule / local / default (NULL on rows saved before tracking)
+    category_source = Column(String, nullable=True)
+    priority_source = Column(String, nullable=True)
     thread_id = Column(String)
     smart_thread_id = Column(String, nullable=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
     attachments = relationship("EmailAttachment", back_populates="email")
+    # Bodies live in email_bodies so list queries only read metadata rows
+    body_record = relationship("EmailBody", uselist=False, back_populates="email")
+
+    # Per-user grouping and ordering for /threads, /smart-threads, /category-stats
+    __table_args__ = (
+        Index("ix_emails_user_category", "user_email", "category"),
+        Index("ix_emails_user_smart_thread", "user_email", "smart_thread_id"),
+        Index("ix_emails_user_timestamp", "user_email", "timestamp"),
+    )
+
+    @property
+    def body(self):
+        """Body text, loaded from email_bodies on first access."""
+        return self.body_record.text if self.body_record else None
+
+
+class EmailBody(Base):
+    """Compressed body of one email."""
+    __tablename__ = "email_bodies"
+
+    email_id = Column(String, ForeignKey("emails.email_id"), primary_key=True)
+    data = Column(LargeBinary, nullable=False)   # zlib-compressed UTF-8
+    # Gmail snippet stored in place of the body; the full body is backfilled later
+    is_snippet = Column(Boolean, nullable=True, default=False, index=True)
+
+    email = relationship("Email", back_populates="body_record")
+
+    @property
+    def text(self):
+        return decompress_body(self.data)
 
 
 
@@ -43,5 +76,52 @@ class EmailAttachment(Base):
     mime_type = Column(String)
     size = Column(Integer)
     attachment_id = Column(String)  # Gmail internal attachment ID
+    content_hash = Column(String, nullable=True)  # SHA-256 in the attachment store, once fetched
+
+    email = relationship("Email", back_populates="attachments")
+
+
+class SyncState(Base):
+    """Last synced Gmail historyId per user, for incremental fetches."""
+    __tablename__ = "sync_state"
 
-    email = relationship("Email", back_populates="attachments")
\ No newline at end of file
+    user_email = Column(String, primary_key=True)
+    history_id = Column(String, nullable=True)
+    failed_ids = Column(String, nullable=True)   # JSON {message id: failed attempts}, retried next sync
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SmartThreadCentroid(Base):
+    """Summed unit TF-IDF vector of one smart thread, written by the re-clustering job."""
+    __tablename__ = "smart_thread_centroids"
+
+    user_email = Column(String, primary_key=True)
+    smart_thread_id = Column(String, primary_key=True)
+    terms = Column(String, nullable=False)   # JSON {token: weight}
+    size = Column(Integer, nullable=False)   # emails in the thread
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class SmartThreadVocabulary(Base):
+    """Subject document frequencies the stored centroids were weighted with."""
+    __tablename__ = "smart_thread_vocabularies"
+
+    user_email = Column(String, primary_key=True)
+    document_frequencies = Column(String, nullable=False)   # JSON {token: subjects containing it}
+    documents = Column(Integer, nullable=False)             # subjects counted
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class SenderRule(Base):
+    """Sender categorization rule; user_email NULL applies to every user."""
+    __tablename__ = "sender_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, nullable=True, index=True)
+    rule_type = Column(String, nullable=False)   # domain / keyword / regex / header
+    pattern = Column(String, nullable=False)
+    header = Column(String, nullable=True)       # header name, for header rules
+    category = Column(String, nullable=False)
+    priority = Column(Integer, nullable=False, default=100)   # lower wins
+    enabled = Column(Boolean, nullable=False, default=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,145 @@
+# database/queries.py
+import base64
+import datetime
+import json
+from fastapi import HTTPException
+from sqlalchemy import func, case, and_, or_, literal, type_coerce, String, DateTime, cast, Date
+from database.models import Email
+
+# Columns returned for emails inside a group (never the body)
+GROUP_EMAIL_COLUMNS = [
+    Email.email_id,
+    Email.sender,
+    Email.subject,
+    Email.summary,
+    Email.priority,
+    Email.category,
+    Email.thread_id,
+    Email.smart_thread_id,
+    Email.timestamp,
+]
+
+
+def encode_cursor(last_ts, key):
+    if isinstance(last_ts, datetime.datetime):
+        last_ts = last_ts.isoformat()
+    raw = json.dumps([last_ts, key])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, dialect_name):
+    """Inverse of encode_cursor; a cursor that wasn't produced by it is a 400."""
+    try:
+        last_ts, key = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if last_ts is not None and not isinstance(last_ts, str):
+            raise ValueError(last_ts)
+        if dialect_name != "sqlite" and last_ts is not None:
+            last_ts = datetime.datetime.fromisoformat(last_ts)
+    except (ValueError, TypeError):
+        # binascii, UTF-8 and JSON errors are all ValueErrors; a wrong shape fails the unpack
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return last_ts, key
+
+
+def _timestamp_type(dialect_name):
+    # SQLite keeps CURRENT_TIMESTAMP text; comparing it as raw text keeps the
+    # keyset exact, where a bound datetime would be rendered with microseconds.
+    return String() if dialect_name == "sqlite" else DateTime(timezone=True)
+
+
+def group_key_expression(mode, dialect_name):
+    """SQL expression for the /threads grouping key of each mode."""
+    if mode == "subject":
+        return func.coalesce(Email.smart_thread_id, "")
+    if mode == "category":
+        return func.coalesce(Email.category, "Uncategorized")
+    if mode == "priority":
+        return func.coalesce(Email.priority, "Medium")
+    if mode == "sender":
+        # Display name part of "Name <address>"
+        sender = func.coalesce(Email.sender, "")
+        if dialect_name == "sqlite":
+            position = func.instr(sender, "<")
+            name = case((position > 0, func.substr(sender, 1, position - 1)), else_=sender)
+        else:
+            name = func.split_part(sender, "<", 1)
+        return func.trim(name)
+    if mode == "date":
+        if dialect_name == "sqlite":
+            return func.date(Email.timestamp)
+        return cast(cast(Email.timestamp, Date), String)
+    return literal("Other")
+
+
+def grouped_emails(db, user_email, key_expr, cursor=None, limit=50, emails_per_group=50):
+    """One page of email groups, newest activity first.
+
+    Groups are found with a GROUP BY over the (user_email, ...) indexes and
+    paged with a keyset cursor on (last activity, key). Only the newest
+    emails_per_group rows of each group on the page are loaded, without
+    bodies. Returns (groups, next_cursor), groups being dicts with
+    group_key / count / emails.
+    """
+    dialect_name = db.get_bind().dialect.name
+    ts_type = _timestamp_type(dialect_name)
+
+    key = key_expr.label("group_key")
+    last_ts = type_coerce(func.max(Email.timestamp), ts_type).label("last_ts")
+    count = func.count().label("count")
+
+    group_query = db.query(key, last_ts, count).filter(
+        Email.user_email == user_email
+    ).group_by(key_expr)
+
+    if cursor:
+        cursor_ts, cursor_key = decode_cursor(cursor, dialect_name)
+        max_ts = type_coerce(func.max(Email.timestamp), ts_type)
+        group_query = group_query.having(or_(
+            max_ts < cursor_ts,
+            and_(max_ts == cursor_ts, key_expr < cursor_key)
+        ))
+
+    rows = group_query.order_by(last_ts.desc(), key.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].last_ts, rows[-1].group_key)
+
+    if not rows:
+        return [], None
+
+    keys = [row.group_key for row in rows]
+    rank = func.row_number().over(
+        partition_by=key_expr,
+        order_by=(Email.timestamp.desc(), Email.email_id.desc())
+    ).label("rank")
+
+    ranked = db.query(*GROUP_EMAIL_COLUMNS, key, rank).filter(
+        Email.user_email == user_email,
+        key_expr.in_(keys)
+    ).subquery()
+
+    email_rows = db.query(ranked).filter(
+        ranked.c.rank <= emails_per_group
+    ).order_by(ranked.c.rank).all()
+
+    emails_by_key = {k: [] for k in keys}
+    for row in email_rows:
+        data = row._asdict()
+        group_key = data.pop("group_key")
+        data.pop("rank")
+        emails_by_key[group_key].append(data)
+
+    groups = [
+        {"group_key": row.group_key, "count": row.count, "emails": emails_by_key[row.group_key]}
+        for row in rows
+    ]
+    return groups, next_cursor
+
+
+def category_counts(db, user_email):
+    rows = db.query(Email.category, func.count()).filter(
+        Email.user_email == user_email
+    ).group_by(Email.category).all()
+    return {category: total for category, total in rows}
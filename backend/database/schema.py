@@ -0,0 +1,105 @@
+# database/schema.py
+import argparse
+from sqlalchemy import inspect, text
+from database.database import Base, engine
+from database.models import EmailBody
+from database.body_store import compress_body, decompress_body
+from database.search import init_search_index, drop_search_triggers
+
+
+def _add_missing_columns(bind, table):
+    """create_all doesn't alter existing tables; add nullable columns introduced since."""
+    existing = {column["name"] for column in inspect(bind).get_columns(table.name)}
+    missing = [c for c in table.columns if c.name not in existing and c.nullable]
+    if not missing:
+        return
+    with bind.begin() as conn:
+        for column in missing:
+            conn.exec_driver_sql(
+                f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"
+            )
+
+
+def _migrate_inline_bodies(bind, drop_column=False, batch_size=1000):
+    """Copy bodies from the old emails.body column into email_bodies.
+
+    The column itself is kept, so a failed or partial copy loses nothing.
+    With ``drop_column`` every inline body is compared with its stored copy
+    first, and the column is only dropped if all of them match.
+    """
+    if "body" not in {column["name"] for column in inspect(bind).get_columns("emails")}:
+        return
+
+    moved = 0
+    with bind.begin() as conn:
+        # The old FTS triggers read emails.body; init_search_index recreates them
+        drop_search_triggers(conn)
+
+        rows = conn.execute(text(
+            "SELECT email_id, body FROM emails WHERE body IS NOT NULL AND body != '' "
+            "AND email_id NOT IN (SELECT email_id FROM email_bodies)"
+        )).fetchall()
+        for start in range(0, len(rows), batch_size):
+            conn.execute(EmailBody.__table__.insert(), [
+                {"email_id": email_id, "data": compress_body(body)}
+                for email_id, body in rows[start:start + batch_size]
+            ])
+            moved += len(rows[start:start + batch_size])
+
+    if moved:
+        print(f"📦 Copied {moved} email bodies to email_bodies")
+    if not drop_column:
+        return
+
+    mismatched = _unverified_inline_bodies(bind, batch_size)
+    if mismatched:
+        print(f"⚠️ Keeping emails.body: {len(mismatched)} bodies don't match email_bodies, e.g. {mismatched[:5]}")
+        return
+
+    with bind.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE emails DROP COLUMN body")
+    print("🗑️ Dropped emails.body")
+
+
+def _unverified_inline_bodies(bind, batch_size=1000):
+    """IDs of emails whose inline body is missing from, or differs from, email_bodies."""
+    mismatched = []
+    with bind.connect() as conn:
+        result = conn.execution_options(yield_per=batch_size).execute(text(
+            "SELECT e.email_id, e.body, b.data FROM emails e "
+            "LEFT JOIN email_bodies b ON b.email_id = e.email_id "
+            "WHERE e.body IS NOT NULL AND e.body != ''"
+        ))
+        for email_id, body, data in result:
+            if data is None or decompress_body(data) != body:
+                mismatched.append(email_id)
+    return mismatched
+
+
+def init_db(bind=engine, drop_inline_bodies=False):
+    """Create tables, any indexes added since the table was created, and the search index.
+
+    Startup never drops columns; ``drop_inline_bodies`` is only set by the
+    explicit migration command below.
+    """
+    Base.metadata.create_all(bind=bind)
+
+    # create_all neither adds columns nor indexes to tables that already exist
+    for table in Base.metadata.sorted_tables:
+        _add_missing_columns(bind, table)
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+    _migrate_inline_bodies(bind, drop_column=drop_inline_bodies)
+    init_search_index(bind)
+
+
+if __name__ == "__main__":
+    # Run from backend/:  python -m database.schema --drop-inline-bodies
+    parser = argparse.ArgumentParser(description="Create or upgrade the database schema.")
+    parser.add_argument(
+        "--drop-inline-bodies", action="store_true",
+        help="drop emails.body once every body is verified in email_bodies"
+    )
+    args = parser.parse_args()
+    init_db(drop_inline_bodies=args.drop_inline_bodies)
@@ -0,0 +1,189 @@
+# database/search.py
+import re
+from sqlalchemy import text
+from database.models import Email
+
+# FTS5 index over the searchable email columns. Rows share the emails
+# table's rowid, so triggers can keep it in sync without a scan. VACUUM
+# can renumber those rowids; run rebuild_search_index() after one. Bodies
+# are stored compressed in email_bodies and indexed through inflate_body(),
+# a SQL function registered on every SQLite connection.
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+        user_email UNINDEXED, subject, sender, body, summary, priority,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS emails_fts_insert AFTER INSERT ON emails BEGIN
+        INSERT INTO emails_fts (rowid, user_email, subject, sender, body, summary, priority)
+        VALUES (
+            new.rowid, new.user_email, new.subject, new.sender,
+            (SELECT inflate_body(data) FROM email_bodies WHERE email_id = new.email_id),
+            new.summary, new.priority
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS emails_fts_delete AFTER DELETE ON emails BEGIN
+        DELETE FROM emails_fts WHERE rowid = old.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS emails_fts_update
+    AFTER UPDATE OF user_email, subject, sender, summary, priority ON emails BEGIN
+        UPDATE emails_fts SET user_email = new.user_email, subject = new.subject,
+            sender = new.sender, summary = new.summary, priority = new.priority
+        WHERE rowid = old.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS email_bodies_fts_insert AFTER INSERT ON email_bodies BEGIN
+        UPDATE emails_fts SET body = inflate_body(new.data)
+        WHERE rowid = (SELECT rowid FROM emails WHERE email_id = new.email_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS email_bodies_fts_update AFTER UPDATE OF data ON email_bodies BEGIN
+        UPDATE emails_fts SET body = inflate_body(new.data)
+        WHERE rowid = (SELECT rowid FROM emails WHERE email_id = new.email_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS email_bodies_fts_delete AFTER DELETE ON email_bodies BEGIN
+        UPDATE emails_fts SET body = NULL
+        WHERE rowid = (SELECT rowid FROM emails WHERE email_id = old.email_id);
+    END
+    """,
+]
+
+FTS_TRIGGERS = [
+    "emails_fts_insert", "emails_fts_delete", "emails_fts_update",
+    "email_bodies_fts_insert", "email_bodies_fts_update", "email_bodies_fts_delete",
+]
+
+# bm25 weights per column: user_email, subject, sender, body, summary, priority
+BM25_WEIGHTS = "0.0, 10.0, 5.0, 1.0, 2.0, 1.0"
+
+# Rank and page on rowids first so snippet() only runs for the returned page
+SEARCH_SQL = f"""
+    SELECT e.email_id, e.sender, e.subject, e.summary, e.priority, e.timestamp,
+           snippet(emails_fts, -1, '<b>', '</b>', '…', 12) AS snippet,
+           page.rank AS rank
+    FROM (
+        SELECT rowid, bm25(emails_fts, {BM25_WEIGHTS}) AS rank
+        FROM emails_fts
+        WHERE emails_fts MATCH :match AND user_email = :user_email
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+    ) AS page
+    JOIN emails_fts ON emails_fts.rowid = page.rowid
+    JOIN emails e ON e.rowid = page.rowid
+    WHERE emails_fts MATCH :match
+    ORDER BY page.rank
+"""
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_enabled(bind):
+    return bind.dialect.name == "sqlite"
+
+
+def init_search_index(engine):
+    """Create the FTS table and triggers, backfilling from emails if it is new."""
+    if not fts_enabled(engine):
+        return
+
+    with engine.begin() as conn:
+        for statement in FTS_SCHEMA:
+            conn.exec_driver_sql(statement)
+
+        indexed = conn.exec_driver_sql("SELECT COUNT(*) FROM emails_fts").scalar()
+        if not indexed:
+            _backfill(conn)
+
+
+def rebuild_search_index(engine):
+    if not fts_enabled(engine):
+        return
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM emails_fts")
+        _backfill(conn)
+
+
+def drop_search_triggers(conn):
+    """Drop the sync triggers; init_search_index() creates the current ones again."""
+    if not fts_enabled(conn):
+        return
+    for name in FTS_TRIGGERS:
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def _backfill(conn):
+    conn.exec_driver_sql(
+        "INSERT INTO emails_fts (rowid, user_email, subject, sender, body, summary, priority) "
+        "SELECT e.rowid, e.user_email, e.subject, e.sender, inflate_body(b.data), e.summary, e.priority "
+        "FROM emails e LEFT JOIN email_bodies b ON b.email_id = e.email_id"
+    )
+
+
+def build_match_query(q):
+    """Turn free text into an FTS5 query: every word must match, as a prefix."""
+    terms = _TERM.findall(q)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def full_text_search(db, user_email, q, limit=20, offset=0):
+    """Ranked full-text search over a user's emails.
+
+    Returns dicts with the email fields plus a highlighted snippet. Falls
+    back to ILIKE matching on databases without FTS5, which only sees the
+    metadata columns and summary since bodies are stored compressed.
+    """
+    if not fts_enabled(db.get_bind()):
+        return _search_emails_ilike(db, user_email, q, limit, offset)
+
+    match = build_match_query(q)
+    if not match:
+        return []
+
+    statement = text(SEARCH_SQL).columns(timestamp=Email.timestamp.type)
+    rows = db.execute(statement, {
+        "match": match,
+        "user_email": user_email,
+        "limit": limit,
+        "offset": offset
+    }).mappings().all()
+
+    return [dict(row) for row in rows]
+
+
+def _search_emails_ilike(db, user_email, q, limit, offset):
+    query_str = f"%{q.lower()}%"
+
+    results = db.query(Email).filter(
+        Email.user_email == user_email,
+        (
+            Email.subject.ilike(query_str) |
+            Email.sender.ilike(query_str) |
+            Email.summary.ilike(query_str) |
+            Email.priority.ilike(query_str)
+        )
+    ).order_by(Email.timestamp.desc()).limit(limit).offset(offset).all()
+
+    return [
+        {
+            "email_id": e.email_id,
+            "sender": e.sender,
+            "subject": e.subject,
+            "summary": e.summary,
+            "priority": e.priority,
+            "timestamp": e.timestamp,
+            "snippet": None,
+            "rank": None
+        }
+        for e in results
+    ]
@@ -1,17 +1,32 @@
 # email_summarizer/email_summarizer.py
 import ssl
+import asyncio
+import anyio
 import requests
 import json
 import os
 import base64
+import html
 import datetime
-from bs4 import BeautifulSoup
+import random
+import threading
+import time
+import httplib2
+from concurrent.futures import ThreadPoolExecutor
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from openai import OpenAI
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+from google_auth_httplib2 import AuthorizedHttp
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
+from email_summarizer.llm_cache import llm_cache, make_key
+from email_summarizer.local_classifier import get_local_classifier
+from email_summarizer.mime import extract_body_and_attachments, EMAIL_BODY_CHAR_BUDGET
+from email_summarizer.sender_rules import sender_rule_engine
+from utils.metrics import REGISTRY, STAGE_SECONDS
 
 load_dotenv("/home/sadlin/LinuxData/mAIL/mAiL/.env")
 # Ignore SSL verification warnings
@@ -19,11 +34,47 @@ load_dotenv("/home/sadlin/LinuxData/mAIL/mAiL/.env")
 ssl._create_default_https_context = ssl._create_unverified_context
 requests.packages.urllib3.disable_warnings()
 
-# OpenAI client (uses OpenRouter API)
+# OpenAI client (uses OpenRouter API; base URL can point at any OpenAI-compatible server)
 client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
+    base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
     api_key=os.getenv("OPENROUTER_API_KEY")
 )
+# Same endpoint for async request handlers, so LLM waits do not hold a worker thread
+async_client = AsyncOpenAI(
+    base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+    api_key=os.getenv("OPENROUTER_API_KEY")
+)
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+
+CATEGORIES = [
+    "Work",
+    "College",
+    "Personal",
+    "Bank/Finance",
+    "Offers/Promotions",
+    "Travel/Tickets",
+    "Bills/Payments",
+    "Security Alert",
+    "Subscriptions/Newsletters",
+    "Events/Conferences",
+    "Important/Deadline",
+    "LinkedIn",
+    "Spam",
+]
+
+# Bump when a prompt changes so cached answers from the old prompt are not reused
+CATEGORY_PROMPT_VERSION = "category-v1"
+OVERALL_SUMMARY_PROMPT_VERSION = "overall-summary-v2"
+
+PRIORITIES = ["High", "Medium", "Low"]
+
+# Overall summary: prompt budget per chunk (approx. tokens) and concurrent LLM calls
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "4000"))
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "4"))
+
+# Batch categorization: prompt budget (approx. tokens) and parse retries
+CATEGORIZE_BATCH_TOKENS = int(os.getenv("CATEGORIZE_BATCH_TOKENS", "6000"))
+CATEGORIZE_MAX_ATTEMPTS = int(os.getenv("CATEGORIZE_MAX_ATTEMPTS", "3"))
 
 # Gmail scopes
 SCOPES = [
@@ -33,84 +84,406 @@ SCOPES = [
     "https://www.googleapis.com/auth/userinfo.profile"
 ]
 
+# Where a stored category / priority came from. Only "llm" labels (and
+# user feedback) are used to train the local model.
+LABEL_SOURCES = ("llm", "rule", "local", "default")
+DEFAULT_CATEGORY = "Personal"
+
+# Gmail batch fetch settings (requests per batch call, retries on 429/5xx)
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "25"))
+GMAIL_MAX_RETRIES = int(os.getenv("GMAIL_MAX_RETRIES", "5"))
+GMAIL_BACKOFF_BASE = float(os.getenv("GMAIL_BACKOFF_BASE", "0.5"))
+GMAIL_BACKOFF_MAX = float(os.getenv("GMAIL_BACKOFF_MAX", "32"))
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# History deltas include drafts, spam and trash, which messages.list leaves out by default
+HISTORY_SKIP_LABELS = {"DRAFT", "SPAM", "TRASH"}
+
+# Gmail also reports per-user and per-project rate limits as 403 with these reasons
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+GMAIL_REQUESTS = REGISTRY.counter(
+    "mail_gmail_requests_total", "Gmail API requests (batch items counted as messages.get).", ["method", "status"]
+)
+GMAIL_SECONDS = REGISTRY.histogram(
+    "mail_gmail_request_seconds", "Gmail API call latency (one batch = one call).", ["method"]
+)
+GMAIL_RETRIES = REGISTRY.counter("mail_gmail_retries_total", "Gmail batch items retried after 429/5xx.")
+LLM_REQUESTS = REGISTRY.counter("mail_llm_requests_total", "LLM chat completions.", ["kind", "status"])
+LLM_SECONDS = REGISTRY.histogram("mail_llm_request_seconds", "LLM chat completion latency.", ["kind"])
+LLM_TOKENS = REGISTRY.counter("mail_llm_tokens_total", "LLM tokens reported by the API.", ["kind", "type"])
+
+# Partial-response mask for tier-1 fetches: top-level headers, snippet and the
+# part tree (a few levels deep) with attachment metadata but no body data
+_PART_FIELDS = "mimeType,filename,body(size,attachmentId)"
+METADATA_FIELDS = (
+    "id,threadId,snippet,"
+    f"payload({_PART_FIELDS},headers(name,value),"
+    f"parts({_PART_FIELDS},parts({_PART_FIELDS},parts({_PART_FIELDS},parts({_PART_FIELDS})))))"
+)
+
+# Fetch full bodies only when categorization needs them (0 = always fetch)
+LAZY_BODY_FETCH = os.getenv("LAZY_BODY_FETCH", "1") == "1"
+
+# Refresh access tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+
+# Per-user cached credentials and Gmail service: {user_email: {"creds", "service", "mtime"}}
+_gmail_cache = {}
+_gmail_auth_locks = {}
+_gmail_cache_lock = threading.Lock()
+
+
+def _write_token(token_path, creds):
+    """Write the token atomically so readers never see a half-written file."""
+    tmp_path = f"{token_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as token:
+        token.write(creds.to_json())
+    os.replace(tmp_path, token_path)
+
+
+def _needs_refresh(creds):
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    # google-auth keeps expiry as naive UTC
+    now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+    return creds.expiry - now < datetime.timedelta(seconds=TOKEN_REFRESH_MARGIN)
+
+
+def _build_gmail_service(creds):
+    """Build a Gmail client that is safe to share across threads.
+
+    httplib2.Http is not thread-safe, so every request gets its own
+    authorized Http instead of sharing the one built with the service.
+    """
+    def build_request(http, *args, **kwargs):
+        return HttpRequest(AuthorizedHttp(creds, http=httplib2.Http()), *args, **kwargs)
+
+    return build('gmail', 'v1', credentials=creds, requestBuilder=build_request, cache_discovery=False)
+
+
+def _user_auth_lock(user_email):
+    with _gmail_cache_lock:
+        lock = _gmail_auth_locks.get(user_email)
+        if lock is None:
+            lock = _gmail_auth_locks[user_email] = threading.Lock()
+        return lock
+
 
 def authenticate_gmail(user_email: str):
-    """Authenticate Gmail for a specific user."""
+    """Authenticate Gmail for a specific user.
+
+    Credentials and the built service are cached per user and reused until
+    the token file changes on disk. Tokens are refreshed shortly before
+    they expire rather than after a request fails.
+    """
     os.makedirs("tokens", exist_ok=True)
     token_path = f"tokens/{user_email}.json"
 
-    creds = None
-    if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+    with _user_auth_lock(user_email):
+        mtime = os.path.getmtime(token_path) if os.path.exists(token_path) else None
+        cached = _gmail_cache.get(user_email)
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
+        if cached and cached["mtime"] == mtime:
+            creds = cached["creds"]
+            if _needs_refresh(creds) and creds.refresh_token:
+                creds.refresh(Request())
+                _write_token(token_path, creds)
+                cached["mtime"] = os.path.getmtime(token_path)
+            if creds.valid:
+                return cached["service"]
+
+        creds = None
+        if mtime is not None:
+            creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+
+        if not creds or _needs_refresh(creds):
+            if creds and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+                creds = flow.run_local_server(port=0)
 
-        with open(token_path, 'w') as token:
-            token.write(creds.to_json())
+            _write_token(token_path, creds)
 
-    return build('gmail', 'v1', credentials=creds)
+        service = _build_gmail_service(creds)
+        _gmail_cache[user_email] = {
+            "creds": creds,
+            "service": service,
+            "mtime": os.path.getmtime(token_path)
+        }
+        return service
 
 
-def get_last_24h_emails(service):
-    """Fetch emails received in last 24 hours."""
+def invalidate_gmail_cache(user_email):
+    """Forget a user's cached credentials and service (e.g. after re-login)."""
+    with _gmail_cache_lock:
+        _gmail_cache.pop(user_email, None)
+
+
+def _gmail_execute(request, method):
+    """request.execute() with latency and status metrics."""
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        return request.execute()
+    except HttpError as e:
+        status = str(e.resp.status)
+        raise
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        GMAIL_SECONDS.observe(time.perf_counter() - started, method=method)
+        GMAIL_REQUESTS.inc(method=method, status=status)
+
+
+def get_last_24h_emails(service, max_results=20):
+    """Fetch emails received in last 24 hours.
+
+    With max_results=None every page is listed (used for full resyncs).
+    """
     now = datetime.datetime.now(datetime.UTC)
     yesterday = now - datetime.timedelta(days=1)
     query = f"after:{int(yesterday.timestamp())}"
-    results = service.users().messages().list(userId='me', q=query, maxResults=20).execute()
-    return results.get('messages', [])
+
+    if max_results is not None:
+        results = _gmail_execute(
+            service.users().messages().list(userId='me', q=query, maxResults=max_results), "messages.list"
+        )
+        return results.get('messages', [])
+
+    messages = []
+    page_token = None
+    while True:
+        results = _gmail_execute(service.users().messages().list(
+            userId='me', q=query, maxResults=500, pageToken=page_token
+        ), "messages.list")
+        messages.extend(results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return messages
+
+
+def get_current_history_id(service):
+    """Current mailbox historyId, used as the starting point for incremental sync."""
+    return _gmail_execute(service.users().getProfile(userId='me'), "getProfile").get('historyId')
+
+
+def get_messages_since(service, history_id):
+    """List messages added since history_id via users.history.list.
+
+    Returns (messages, latest_history_id). messages is None when Gmail no
+    longer has that history (404), meaning a full resync is needed.
+    """
+    messages = {}
+    latest_history_id = history_id
+    page_token = None
+
+    while True:
+        try:
+            results = _gmail_execute(service.users().history().list(
+                userId='me',
+                startHistoryId=history_id,
+                historyTypes=['messageAdded'],
+                pageToken=page_token
+            ), "history.list")
+        except HttpError as e:
+            if e.resp.status == 404:
+                return None, None
+            raise
+
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []):
+                msg = added['message']
+                if HISTORY_SKIP_LABELS.intersection(msg.get('labelIds', [])):
+                    continue
+                messages.setdefault(msg['id'], {'id': msg['id'], 'threadId': msg.get('threadId')})
+
+        latest_history_id = results.get('historyId', latest_history_id)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return list(messages.values()), latest_history_id
 
 
 def get_email_details(service, msg_id):
-    msg = service.users().messages().get(
+    msg = _gmail_execute(service.users().messages().get(
         userId='me',
         id=msg_id,
         format='full'
-    ).execute()
+    ), "messages.get")
+
+    return parse_email_message(msg)
+
+
+def get_attachment_bytes(service, msg_id, attachment_id):
+    """Download one attachment's content through the Gmail attachments API."""
+    result = _gmail_execute(service.users().messages().attachments().get(
+        userId='me',
+        messageId=msg_id,
+        id=attachment_id
+    ), "attachments.get")
+
+    data = result["data"]
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
 
+
+def parse_email_message(msg):
+    """Extract (sender, subject, body, thread_id, attachments) from a full Gmail message."""
     headers = msg['payload']['headers']
-    parts = msg['payload'].get('parts', [])
 
     sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
     subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
 
-    body = ""
-    attachments = []
-
-    for part in parts:
-        mime_type = part.get("mimeType", "")
-        filename = part.get("filename", "")
-
-        # ATTACHMENT detection
-        if filename:
-            body_info = part.get("body", {})
-            attachments.append({
-                "filename": filename,
-                "mime_type": mime_type,
-                "size": body_info.get("size", 0),
-                "attachment_id": body_info.get("attachmentId")
-            })
-            continue
-
-        # Extract body (text/plain or html)
-        data = part.get("body", {}).get("data")
-        if data:
-            try:
-                decoded = base64.urlsafe_b64decode(data).decode("utf-8")
-                body = decoded
-            except:
-                pass
+    # Nested multiparts are walked recursively; decoding stops at the body budget
+    body, attachments = extract_body_and_attachments(msg['payload'], EMAIL_BODY_CHAR_BUDGET)
 
-    clean_body = body.strip().replace("\r", "").replace("\n", " ")[:2000]
+    clean_body = body.strip().replace("\r", "").replace("\n", " ")[:EMAIL_BODY_CHAR_BUDGET]
     thread_id = msg.get("threadId")
 
     return sender, subject, clean_body, thread_id, attachments
 
 
+def _error_reasons(error):
+    """The "reason" values in a Gmail error body, e.g. {"userRateLimitExceeded"}."""
+    try:
+        payload = json.loads(error.content)
+    except (TypeError, ValueError):
+        return set()
+    details = payload.get("error") if isinstance(payload, dict) else None
+    if not isinstance(details, dict):
+        return set()
+    return {
+        item.get("reason")
+        for item in (details.get("errors") or []) + (details.get("details") or [])
+        if isinstance(item, dict)
+    }
+
+
+def _is_retryable(error):
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status in RETRYABLE_STATUS:
+        return True
+    return error.resp.status == 403 and bool(_error_reasons(error) & RATE_LIMIT_REASONS)
+
+
+def _backoff(attempt):
+    delay = min(GMAIL_BACKOFF_MAX, GMAIL_BACKOFF_BASE * (2 ** attempt))
+    time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+def _batch_get_messages(service, msg_ids, parse, batch_size=None, max_retries=None, **get_kwargs):
+    """Run messages.get for many IDs through Gmail batch requests; returns {msg_id: parse(msg)}.
+
+    Items that fail with 429/5xx or a rate-limit 403 are retried with
+    exponential backoff; other failures, including messages that fail to
+    parse, are skipped.
+    """
+    batch_size = batch_size or GMAIL_BATCH_SIZE
+    max_retries = GMAIL_MAX_RETRIES if max_retries is None else max_retries
+
+    results = {}
+    pending = list(dict.fromkeys(msg_ids))
+    attempt = 0
+
+    while pending:
+        retry = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                GMAIL_REQUESTS.inc(method="messages.get", status="ok")
+                started = time.perf_counter()
+                try:
+                    results[request_id] = parse(response)
+                except Exception as e:
+                    # One malformed message must not abort the rest of the batch
+                    print(f"❌ Failed to parse message {request_id}: {e}")
+                    return
+                finally:
+                    STAGE_SECONDS.observe(time.perf_counter() - started, stage="mime_parse")
+                return
+
+            status = str(exception.resp.status) if isinstance(exception, HttpError) else "error"
+            GMAIL_REQUESTS.inc(method="messages.get", status=status)
+            if _is_retryable(exception):
+                retry.append(request_id)
+            else:
+                print(f"❌ Failed to fetch message {request_id}: {exception}")
+
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=callback)
+            for msg_id in chunk:
+                batch.add(
+                    service.users().messages().get(userId='me', id=msg_id, **get_kwargs),
+                    request_id=msg_id
+                )
+            try:
+                _gmail_execute(batch, "batch")
+            except HttpError as e:
+                if not _is_retryable(e):
+                    raise
+                retry.extend(m for m in chunk if m not in results and m not in retry)
+
+        if retry:
+            if attempt >= max_retries:
+                print(f"⚠️ Giving up on {len(retry)} messages after {attempt} retries")
+                break
+            GMAIL_RETRIES.inc(len(retry))
+            _backoff(attempt)
+            attempt += 1
+        pending = retry
+
+    return results
+
+
+def get_emails_details_batch(service, msg_ids, batch_size=None, max_retries=None):
+    """Fetch many full messages through Gmail batch requests.
+
+    Returns {msg_id: (sender, subject, body, thread_id, attachments)}, the
+    same tuple as get_email_details.
+    """
+    return _batch_get_messages(
+        service, msg_ids, parse_email_message,
+        batch_size=batch_size, max_retries=max_retries, format='full'
+    )
+
+
+def parse_email_metadata(msg):
+    """Extract (sender, subject, snippet, thread_id, attachments, headers) from a metadata-tier message.
+
+    headers maps lower-cased header names to values, for header sender rules.
+    """
+    headers = msg.get('payload', {}).get('headers', [])
+
+    sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+    snippet = html.unescape(msg.get('snippet', ''))
+
+    # Part tree without body data: enough to list attachments
+    _, attachments = extract_body_and_attachments(msg.get('payload', {}))
+
+    rule_headers = {h['name'].lower(): h['value'] for h in headers}
+
+    return sender, subject, snippet, msg.get('threadId'), attachments, rule_headers
+
+
+def get_emails_metadata_batch(service, msg_ids, batch_size=None, max_retries=None):
+    """Tier-1 fetch: headers, snippet and attachment metadata, without any body data.
+
+    Returns {msg_id: (sender, subject, snippet, thread_id, attachments, headers)}.
+    Bodies are fetched separately, only for messages that need them.
+    """
+    return _batch_get_messages(
+        service, msg_ids, parse_email_metadata,
+        batch_size=batch_size, max_retries=max_retries,
+        format='full', fields=METADATA_FIELDS
+    )
+
+
 def summarize_email(subject, body):
     """Simple text-based summarization."""
     text = body.split('.')
@@ -120,47 +493,288 @@ def summarize_email(subject, body):
     return summary
 
 
-def analyze_emails_with_ai(emails):
-    """Analyze and prioritize emails using GPT."""
-    email_text = "\n".join([
-        f"From: {e['from']}\nSubject: {e['subject']}\nSummary: {e['summary']}"
-        for e in emails
-    ])
+def _record_llm_call(kind, response, started):
+    LLM_SECONDS.observe(time.perf_counter() - started, kind=kind)
+    LLM_REQUESTS.inc(kind=kind, status="ok")
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens or 0, kind=kind, type="prompt")
+        LLM_TOKENS.inc(usage.completion_tokens or 0, kind=kind, type="completion")
 
-    prompt = f"""
+
+def _chat_completion(prompt, kind):
+    """One-message chat completion, with call / latency / token metrics under kind."""
+    started = time.perf_counter()
+    try:
+        response = client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+        )
+    except Exception:
+        LLM_REQUESTS.inc(kind=kind, status="error")
+        raise
+    _record_llm_call(kind, response, started)
+    return response
+
+
+async def _chat_completion_async(prompt, kind):
+    started = time.perf_counter()
+    try:
+        response = await async_client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+        )
+    except Exception:
+        LLM_REQUESTS.inc(kind=kind, status="error")
+        raise
+    _record_llm_call(kind, response, started)
+    return response
+
+
+def _chunk_cache_key(chunk):
+    return make_key(LLM_MODEL, OVERALL_SUMMARY_PROMPT_VERSION, ["chunk"] + [text for _, text in chunk])
+
+
+def _merge_cache_key(summaries):
+    return make_key(LLM_MODEL, OVERALL_SUMMARY_PROMPT_VERSION, ["merge"] + summaries)
+
+
+def _chunk_prompt(chunk):
+    emails_json = "\n".join(text for _, text in chunk)
+
+    return f"""
     You are an intelligent email assistant. You MUST return a VALID JSON ONLY.
 
     Based on these emails, produce:
-    1. An overall summary.
+    1. A short summary of what they are about.
     2. Priority for each email: High / Medium / Low.
 
     Return JSON in this EXACT format:
     {{
-      "overall_summary": "summary text",
+      "summary": "summary text",
       "priorities": [
-        {{"subject": "subject text", "priority": "High"}},
+        {{"id": "email id", "priority": "High"}},
         ...
       ]
     }}
 
-    Emails:
-    {email_text}
+    Emails (one JSON object per line):
+{emails_json}
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-    )
 
-    raw_output = response.choices[0].message.content.strip()
+def _parse_chunk_output(raw_output, chunk):
+    """{"summary": text, "priorities": {email_id: priority}} from a chunk response; None if unparseable."""
     try:
-        return json.loads(raw_output)
-    except:
-        return {"overall_summary": raw_output, "priorities": []}
+        data = _parse_json_output(raw_output)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    valid = {p.lower(): p for p in PRIORITIES}
+    wanted = {email_id for email_id, _ in chunk}
+    priorities = {}
+    for entry in data.get("priorities") or []:
+        if not isinstance(entry, dict):
+            continue
+        email_id = str(entry.get("id", ""))
+        priority = valid.get(str(entry.get("priority", "")).strip().lower())
+        if email_id in wanted and priority:
+            priorities[email_id] = priority
+
+    return {"summary": str(data.get("summary", "")), "priorities": priorities}
+
+
+def _merge_prompt(summaries):
+    parts = "\n\n".join(f"Part {i}:\n{summary}" for i, summary in enumerate(summaries, 1))
+
+    return f"""
+    You are an intelligent email assistant. Below are summaries of different
+    groups of the same user's emails. Combine them into ONE overall summary of
+    the user's inbox, keeping the most important points. Return only the
+    summary text.
+
+{parts}
+    """
+
+
+def _summarize_chunk_with_ai(chunk):
+    """Map step: summary and priorities for one chunk of (email_id, item_text) pairs.
+
+    Returns {"summary": text, "priorities": {email_id: priority}}.
+    """
+    cache_key = _chunk_cache_key(chunk)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    response = _chat_completion(_chunk_prompt(chunk), "summary_chunk")
+
+    raw_output = response.choices[0].message.content.strip()
+    result = _parse_chunk_output(raw_output, chunk)
+    if result is None:
+        return {"summary": raw_output, "priorities": {}}
+
+    llm_cache.set(cache_key, result)
+    return result
+
+
+def _merge_summaries_with_ai(summaries):
+    """Reduce step: one overall summary from several partial summaries."""
+    cache_key = _merge_cache_key(summaries)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    response = _chat_completion(_merge_prompt(summaries), "summary_merge")
+
+    summary = response.choices[0].message.content.strip()
+    llm_cache.set(cache_key, summary)
+    return summary
+
+
+def _map_concurrently(fn, items):
+    if len(items) == 1:
+        return [fn(items[0])]
+    with ThreadPoolExecutor(max_workers=min(SUMMARY_MAX_WORKERS, len(items))) as pool:
+        return list(pool.map(fn, items))
 
 
-def categorize_email_with_ai(subject, body, sender=None):
-    """Advanced intelligent categorization using GPT."""
+def _summary_items(emails):
+    """(ids, [(email_id, item_text)]) for the map step; emails without an email_id use their position."""
+    ids = [str(e.get("email_id") or i) for i, e in enumerate(emails)]
+    items = [
+        (email_id, json.dumps({"id": email_id, "from": e["from"], "subject": e["subject"], "summary": e["summary"]}))
+        for email_id, e in zip(ids, emails)
+    ]
+    return ids, items
+
+
+def _merge_groups(summaries, chunk_tokens):
+    """Group partial summaries for one merge round; every round shrinks the list."""
+    groups = _split_by_token_budget(list(enumerate(summaries)), chunk_tokens)
+    if len(groups) == len(summaries):
+        # Every summary fills a prompt on its own: merge pairwise
+        groups = [list(enumerate(summaries))[i:i + 2] for i in range(0, len(summaries), 2)]
+    return [[text for _, text in group] for group in groups]
+
+
+def _analysis_result(ids, emails, partials, overall_summary):
+    priorities = {}
+    for partial in partials:
+        priorities.update(partial["priorities"])
+
+    return {
+        "overall_summary": overall_summary,
+        "priorities": [
+            {"email_id": email_id, "subject": e["subject"], "priority": priorities[email_id]}
+            for email_id, e in zip(ids, emails)
+            if email_id in priorities
+        ]
+    }
+
+
+def analyze_emails_with_ai(emails, chunk_tokens=None):
+    """Analyze and prioritize emails using GPT, map-reduce style.
+
+    Emails are split into chunks under chunk_tokens (approx.), each chunk
+    is summarized and prioritized by its own concurrent call, and the
+    partial summaries are merged (in rounds, if they do not fit one prompt).
+    Returns {"overall_summary": text, "priorities": [{"email_id", "subject", "priority"}]};
+    emails without an email_id are keyed by their position.
+    """
+    chunk_tokens = chunk_tokens or SUMMARY_CHUNK_TOKENS
+    if not emails:
+        return {"overall_summary": "", "priorities": []}
+
+    ids, items = _summary_items(emails)
+    partials = _map_concurrently(_summarize_chunk_with_ai, _split_by_token_budget(items, chunk_tokens))
+
+    summaries = [partial["summary"] for partial in partials]
+    while len(summaries) > 1:
+        summaries = _map_concurrently(
+            lambda group: _merge_summaries_with_ai(group) if len(group) > 1 else group[0],
+            _merge_groups(summaries, chunk_tokens)
+        )
+
+    return _analysis_result(ids, emails, partials, summaries[0])
+
+
+async def _summarize_chunk_with_ai_async(chunk, semaphore):
+    # The cache takes a lock and writes to sqlite, so it runs on a worker thread, not the loop
+    cache_key = _chunk_cache_key(chunk)
+    cached = await anyio.to_thread.run_sync(llm_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    async with semaphore:
+        response = await _chat_completion_async(_chunk_prompt(chunk), "summary_chunk")
+
+    raw_output = response.choices[0].message.content.strip()
+    result = _parse_chunk_output(raw_output, chunk)
+    if result is None:
+        return {"summary": raw_output, "priorities": {}}
+
+    await anyio.to_thread.run_sync(llm_cache.set, cache_key, result)
+    return result
+
+
+async def _merge_summaries_with_ai_async(summaries, semaphore):
+    if len(summaries) == 1:
+        return summaries[0]
+
+    cache_key = _merge_cache_key(summaries)
+    cached = await anyio.to_thread.run_sync(llm_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    async with semaphore:
+        response = await _chat_completion_async(_merge_prompt(summaries), "summary_merge")
+
+    summary = response.choices[0].message.content.strip()
+    await anyio.to_thread.run_sync(llm_cache.set, cache_key, summary)
+    return summary
+
+
+async def analyze_emails_with_ai_async(emails, chunk_tokens=None):
+    """analyze_emails_with_ai on the event loop: same chunks, prompts, cache and result."""
+    chunk_tokens = chunk_tokens or SUMMARY_CHUNK_TOKENS
+    if not emails:
+        return {"overall_summary": "", "priorities": []}
+
+    semaphore = asyncio.Semaphore(SUMMARY_MAX_WORKERS)
+    ids, items = _summary_items(emails)
+    partials = await asyncio.gather(*[
+        _summarize_chunk_with_ai_async(chunk, semaphore)
+        for chunk in _split_by_token_budget(items, chunk_tokens)
+    ])
+
+    summaries = [partial["summary"] for partial in partials]
+    while len(summaries) > 1:
+        summaries = await asyncio.gather(*[
+            _merge_summaries_with_ai_async(group, semaphore)
+            for group in _merge_groups(summaries, chunk_tokens)
+        ])
+
+    return _analysis_result(ids, emails, partials, summaries[0])
+
+
+def _category_cache_key(subject, body, sender):
+    # Shared by the single and batch categorizers: same input, same answer
+    return make_key(LLM_MODEL, CATEGORY_PROMPT_VERSION, {
+        "sender": sender,
+        "subject": subject,
+        "body": (body or "")[:1000]
+    })
+
+
+def categorize_email_with_ai(subject, body, sender=None, default=DEFAULT_CATEGORY):
+    """Advanced intelligent categorization using GPT; ``default`` when the reply can't be parsed."""
+    cache_key = _category_cache_key(subject, body, sender)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     prompt = f"""
     Analyze the email and assign the MOST appropriate category.
@@ -192,45 +806,232 @@ def categorize_email_with_ai(subject, body, sender=None):
     }}
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-    )
+    response = _chat_completion(prompt, "category")
 
     raw_output = response.choices[0].message.content.strip()
 
     try:
         data = json.loads(raw_output)
-        return data.get("category", "Personal")
     except:
-        return "Personal"
+        return default
 
+    category = data.get("category")
+    if not category:
+        return default
+    llm_cache.set(cache_key, category)
+    return category
 
-def infer_category_from_sender(sender):
-    sender = sender.lower()
 
-    if "vit.edu" in sender:
-        return "College"
-    if "bank" in sender or "hdfc" in sender or "sbi" in sender:
-        return "Bank/Finance"
-    if "no-reply" in sender or "newsletter" in sender:
-        return "Subscriptions/Newsletters"
-    if "security" in sender:
-        return "Security Alert"
-    
-    return None
+def _estimate_tokens(text):
+    # Rough 4 characters per token; only used to size batches
+    return len(text) // 4 + 1
+
+
+def _parse_json_output(raw_output):
+    """json.loads that tolerates a ```json fenced block around the payload."""
+    raw_output = raw_output.strip()
+    if raw_output.startswith("```"):
+        raw_output = raw_output.strip("`")
+        if raw_output.startswith("json"):
+            raw_output = raw_output[4:]
+    return json.loads(raw_output)
+
+
+def _split_by_token_budget(items, budget):
+    """Group (email_id, item_text) pairs into batches under the token budget."""
+    batches = []
+    current = []
+    used = 0
+    for email_id, text in items:
+        cost = _estimate_tokens(text)
+        if current and used + cost > budget:
+            batches.append(current)
+            current = []
+            used = 0
+        current.append((email_id, text))
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _categorize_batch_with_ai(batch):
+    """One chat completion for a batch; returns {email_id: category} for parsed items."""
+    emails_json = "\n".join(text for _, text in batch)
+    category_list = "\n".join(f"    - {c}" for c in CATEGORIES)
+
+    prompt = f"""
+    Analyze each email below and assign the MOST appropriate category.
+
+    You MUST choose from these categories ONLY:
+
+{category_list}
+
+    Emails (one JSON object per line):
+{emails_json}
+
+    Return a JSON array ONLY, with one entry per email, in this exact format:
+    [
+        {{"id": "email id", "category": "CategoryName"}},
+        ...
+    ]
+    """
+
+    response = _chat_completion(prompt, "category_batch")
+
+    raw_output = response.choices[0].message.content.strip()
+    try:
+        data = _parse_json_output(raw_output)
+    except ValueError:
+        return {}
+
+    if isinstance(data, dict):
+        data = data.get("results") or data.get("emails") or []
+
+    valid = {c.lower(): c for c in CATEGORIES}
+    wanted = {email_id for email_id, _ in batch}
+    categories = {}
+    for entry in data if isinstance(data, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        email_id = str(entry.get("id", ""))
+        category = valid.get(str(entry.get("category", "")).strip().lower())
+        if email_id in wanted and category:
+            categories[email_id] = category
+    return categories
+
+
+def categorize_emails_with_ai_batch(emails, token_budget=None, max_attempts=None, default=DEFAULT_CATEGORY):
+    """Categorize many emails with one chat completion per token-bounded batch.
+
+    emails is a list of dicts with email_id / subject / body / sender.
+    Items the model leaves out or answers with an unknown category are
+    re-sent on the next attempt; anything still unparsed after
+    max_attempts gets ``default`` (left out if None). Returns
+    {email_id: category}.
+    """
+    token_budget = token_budget or CATEGORIZE_BATCH_TOKENS
+    max_attempts = max_attempts or CATEGORIZE_MAX_ATTEMPTS
+
+    items = {
+        e["email_id"]: json.dumps({
+            "id": e["email_id"],
+            "sender": e.get("sender"),
+            "subject": e.get("subject"),
+            "body": (e.get("body") or "")[:1000]
+        })
+        for e in emails
+    }
+
+    results = {}
+    cache_keys = {
+        e["email_id"]: _category_cache_key(e.get("subject"), e.get("body"), e.get("sender"))
+        for e in emails
+    }
+    for email_id, key in cache_keys.items():
+        cached = llm_cache.get(key)
+        if cached is not None:
+            results[email_id] = cached
+
+    pending = [i for i in items if i not in results]
+    for attempt in range(max_attempts):
+        if not pending:
+            break
+        for batch in _split_by_token_budget([(i, items[i]) for i in pending], token_budget):
+            try:
+                parsed = _categorize_batch_with_ai(batch)
+            except Exception as e:
+                print(f"❌ Batch categorization failed ({len(batch)} emails): {e}")
+                continue
+            for email_id, category in parsed.items():
+                results[email_id] = category
+                llm_cache.set(cache_keys[email_id], category)
+        pending = [i for i in pending if i not in results]
+
+    if default is not None:
+        for email_id in pending:
+            results[email_id] = default
+    return results
+
+
+def match_sender_rule(sender, user_email=None, headers=None):
+    """The sender rule that fires for this email, as RuleMatch(category, rule_id, rule_type), or None."""
+    return sender_rule_engine.match(sender, user_email=user_email, headers=headers)
+
+
+def infer_category_from_sender(sender, user_email=None, headers=None):
+    match = match_sender_rule(sender, user_email=user_email, headers=headers)
+    return match.category if match else None
+
+
+def categorize_locally(emails):
+    """Confident local-model categories for dicts with email_id / sender / subject / body."""
+    model = get_local_classifier()
+    if model is None or not emails:
+        return {}
+    labels = model.predict_confident("category", emails)
+    return {e["email_id"]: label for e, label in zip(emails, labels) if label}
 
 
 def smart_categorize_email(subject, body, sender):
+    """Returns (category, source); source is one of LABEL_SOURCES."""
     # 1️⃣ Domain-based quick classification
     sender_based = infer_category_from_sender(sender)
     if sender_based:
-        return sender_based
+        return sender_based, "rule"
+
+    # 2️⃣ Local model, when it is confident
+    local = categorize_locally([{"email_id": None, "sender": sender, "subject": subject, "body": body}])
+    if local:
+        return local[None], "local"
+
+    # 3️⃣ AI-based classification
+    ai_category = categorize_email_with_ai(subject, body, sender, default=None)
+    if ai_category is None:
+        return DEFAULT_CATEGORY, "default"
 
-    # 2️⃣ AI-based classification
-    ai_category = categorize_email_with_ai(subject, body, sender)
+    return ai_category, "llm"
+
+
+def smart_categorize_emails(emails, user_email=None, sources=None, local=None):
+    """Batch version of smart_categorize_email; returns {email_id: category}.
+
+    If ``sources`` is a dict it is filled with {email_id: source}, where
+    source is one of LABEL_SOURCES. ``local`` holds answers from an earlier
+    local-model pass ({email_id: category or None}); those emails are not
+    run through the model again.
+    """
+    sources = {} if sources is None else sources
+    categories = {}
+    needs_ai = []
+    for e in emails:
+        sender_based = infer_category_from_sender(e.get("sender") or "", user_email, e.get("headers"))
+        if sender_based:
+            categories[e["email_id"]] = sender_based
+            sources[e["email_id"]] = "rule"
+        else:
+            needs_ai.append(e)
+
+    # Only what neither the rules nor the local model can answer goes to the LLM
+    checked = local or {}
+    local = categorize_locally([e for e in needs_ai if e["email_id"] not in checked])
+    local.update(
+        (e["email_id"], checked[e["email_id"]])
+        for e in needs_ai if checked.get(e["email_id"])
+    )
+    categories.update(local)
+    sources.update((email_id, "local") for email_id in local)
+    needs_ai = [e for e in needs_ai if e["email_id"] not in local]
 
-    return ai_category
+    if needs_ai:
+        ai = categorize_emails_with_ai_batch(needs_ai, default=None)
+        categories.update(ai)
+        sources.update((email_id, "llm") for email_id in ai)
+        for e in needs_ai:
+            if e["email_id"] not in ai:
+                categories[e["email_id"]] = DEFAULT_CATEGORY
+                sources[e["email_id"]] = "default"
+    return categories
 
 
 def main():
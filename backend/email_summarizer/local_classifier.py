@@ -0,0 +1,116 @@
+# email_summarizer/local_classifier.py
+import os
+import pickle
+import re
+import threading
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "local_classifier.pkl")
+# Predictions below this probability go to the LLM instead
+LOCAL_MODEL_MIN_CONFIDENCE = float(os.getenv("LOCAL_MODEL_MIN_CONFIDENCE", "0.8"))
+# Labelled rows needed before a model is trained at all
+LOCAL_MODEL_MIN_SAMPLES = int(os.getenv("LOCAL_MODEL_MIN_SAMPLES", "50"))
+
+_ADDRESS = re.compile(r"@([\w.-]+)")
+
+
+def _email_text(sender, subject, body):
+    """Flatten an email into one string, with the sender domain as its own token."""
+    sender = sender or ""
+    domain = _ADDRESS.search(sender)
+    domain_token = f" senderdomain_{domain.group(1).replace('.', '_')}" if domain else ""
+    return f"{sender}{domain_token} {subject or ''} {(body or '')[:1000]}".lower()
+
+
+class LocalClassifier:
+    """Hashed word n-grams + linear models for category and priority."""
+
+    def __init__(self):
+        # Stateless features: nothing to fit, and new words need no vocabulary update
+        self.vectorizer = HashingVectorizer(
+            n_features=2 ** 18, ngram_range=(1, 2), alternate_sign=False, norm="l2"
+        )
+        self.models = {}
+
+    def _features(self, emails):
+        return self.vectorizer.transform([
+            _email_text(e.get("sender"), e.get("subject"), e.get("body")) for e in emails
+        ])
+
+    def train(self, samples):
+        """Fit one model per target from dicts with sender / subject / body / category / priority / weight.
+
+        Returns {target: rows used}. Targets with too few rows or only one
+        label are left untrained.
+        """
+        trained = {}
+        for target in ("category", "priority"):
+            rows = [s for s in samples if s.get(target)]
+            labels = {s[target] for s in rows}
+            if len(rows) < LOCAL_MODEL_MIN_SAMPLES or len(labels) < 2:
+                continue
+
+            model = SGDClassifier(loss="log_loss", alpha=1e-5, max_iter=30, tol=None, random_state=0)
+            model.fit(
+                self._features(rows),
+                [s[target] for s in rows],
+                sample_weight=[s.get("weight", 1.0) for s in rows]
+            )
+            self.models[target] = model
+            trained[target] = len(rows)
+        return trained
+
+    def predict(self, target, emails):
+        """[(label, confidence)] per email; (None, 0.0) when the target has no model."""
+        model = self.models.get(target)
+        if model is None or not emails:
+            return [(None, 0.0)] * len(emails)
+
+        probabilities = model.predict_proba(self._features(emails))
+        best = probabilities.argmax(axis=1)
+        return [
+            (str(model.classes_[i]), float(p[i]))
+            for i, p in zip(best, probabilities)
+        ]
+
+    def predict_confident(self, target, emails, min_confidence=None):
+        """Labels only where confidence clears the threshold, else None."""
+        min_confidence = LOCAL_MODEL_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        return [
+            label if label is not None and confidence >= min_confidence else None
+            for label, confidence in self.predict(target, emails)
+        ]
+
+
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_local_classifier():
+    """The current model, loaded from LOCAL_MODEL_PATH on first use (None if never trained)."""
+    global _model, _model_loaded
+    with _model_lock:
+        if not _model_loaded:
+            _model_loaded = True
+            if os.path.exists(LOCAL_MODEL_PATH):
+                try:
+                    with open(LOCAL_MODEL_PATH, "rb") as f:
+                        _model = pickle.load(f)
+                except Exception as e:
+                    print(f"⚠️ Could not load local classifier: {e}")
+        return _model
+
+
+def set_local_classifier(model):
+    """Swap in a newly trained model and persist it atomically."""
+    global _model, _model_loaded
+    tmp_path = f"{LOCAL_MODEL_PATH}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(model, f)
+    os.replace(tmp_path, LOCAL_MODEL_PATH)
+
+    with _model_lock:
+        _model = model
+        _model_loaded = True
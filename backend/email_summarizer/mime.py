@@ -0,0 +1,115 @@
+# email_summarizer/mime.py
+import base64
+import codecs
+import os
+from bs4 import BeautifulSoup
+
+# Characters of body text kept per email
+EMAIL_BODY_CHAR_BUDGET = int(os.getenv("EMAIL_BODY_CHAR_BUDGET", "2000"))
+
+# HTML carries markup, so decode this many times the budget before stripping tags
+HTML_BUDGET_FACTOR = int(os.getenv("HTML_BUDGET_FACTOR", "8"))
+
+
+def iter_parts(payload):
+    """Yield every MIME part of a Gmail payload, depth-first in document order."""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        yield part
+        stack.extend(reversed(part.get("parts") or []))
+
+
+def _charset(part):
+    for header in part.get("headers") or []:
+        if header.get("name", "").lower() == "content-type":
+            for param in header.get("value", "").split(";")[1:]:
+                key, _, value = param.strip().partition("=")
+                if key.lower() == "charset" and value:
+                    charset = value.strip('"\' ')
+                    try:
+                        codecs.lookup(charset)
+                        return charset
+                    except LookupError:
+                        break
+    return "utf-8"
+
+
+def decode_prefix(data, max_chars, charset="utf-8"):
+    """Decode only as much base64url data as max_chars characters can need.
+
+    Cuts the input at a 4-character boundary so the prefix is valid
+    base64; a character split by the cut is dropped.
+    """
+    max_bytes = max_chars * 4   # worst case for UTF-8
+    chunk = data[:((max_bytes + 2) // 3) * 4]
+    chunk += "=" * (-len(chunk) % 4)
+    raw = base64.urlsafe_b64decode(chunk)
+    return raw.decode(charset, errors="ignore")[:max_chars]
+
+
+def html_to_text(html):
+    return BeautifulSoup(html, "html.parser").get_text(" ", strip=True)
+
+
+def extract_body_and_attachments(payload, budget=None):
+    """Walk a Gmail payload at any depth; returns (body text, attachments).
+
+    text/plain parts are preferred and joined by newlines until the budget is
+    reached; HTML is only decoded (and converted to text) when there is
+    no plain text. Parts are decoded lazily, so the work depends on the
+    budget rather than on the size of the message.
+    """
+    budget = budget or EMAIL_BODY_CHAR_BUDGET
+
+    plain_parts = []
+    html_parts = []
+    attachments = []
+
+    for part in iter_parts(payload):
+        mime_type = part.get("mimeType", "")
+        body_info = part.get("body") or {}
+
+        # ATTACHMENT detection
+        if part.get("filename"):
+            attachments.append({
+                "filename": part["filename"],
+                "mime_type": mime_type,
+                "size": body_info.get("size", 0),
+                "attachment_id": body_info.get("attachmentId")
+            })
+            continue
+
+        if not body_info.get("data"):
+            continue
+        if mime_type == "text/plain":
+            plain_parts.append(part)
+        elif mime_type == "text/html":
+            html_parts.append(part)
+
+    # Parts are joined by newlines so words at part boundaries stay separate
+    texts = []
+    used = 0
+    for part in plain_parts:
+        remaining = budget - used
+        if remaining <= 0:
+            break
+        try:
+            text = decode_prefix(part["body"]["data"], remaining, _charset(part))
+        except ValueError:
+            continue
+        texts.append(text)
+        used += len(text) + 1
+    body = "\n".join(texts)
+
+    if not body.strip():
+        for part in html_parts:
+            try:
+                html = decode_prefix(part["body"]["data"], budget * HTML_BUDGET_FACTOR, _charset(part))
+            except ValueError:
+                continue
+            body = html_to_text(html)[:budget]
+            if body.strip():
+                break
+
+    return body, attachments
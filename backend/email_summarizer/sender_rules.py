@@ -0,0 +1,281 @@
+# email_summarizer/sender_rules.py
+import json
+import os
+import re
+import threading
+import time
+from collections import deque, namedtuple
+
+# Rules file (JSON list) and how often sources are checked for changes
+SENDER_RULES_PATH = os.getenv("SENDER_RULES_PATH", "sender_rules.json")
+SENDER_RULES_RELOAD_SECONDS = int(os.getenv("SENDER_RULES_RELOAD_SECONDS", "30"))
+
+# Built-in rules, same order and behaviour as the old hardcoded checks
+DEFAULT_RULES = [
+    {"id": "default-college", "type": "keyword", "pattern": "vit.edu", "category": "College"},
+    {"id": "default-bank", "type": "keyword", "pattern": "bank", "category": "Bank/Finance"},
+    {"id": "default-hdfc", "type": "keyword", "pattern": "hdfc", "category": "Bank/Finance"},
+    {"id": "default-sbi", "type": "keyword", "pattern": "sbi", "category": "Bank/Finance"},
+    {"id": "default-no-reply", "type": "keyword", "pattern": "no-reply", "category": "Subscriptions/Newsletters"},
+    {"id": "default-newsletter", "type": "keyword", "pattern": "newsletter", "category": "Subscriptions/Newsletters"},
+    {"id": "default-security", "type": "keyword", "pattern": "security", "category": "Security Alert"},
+]
+
+RULE_TYPES = ("domain", "keyword", "regex", "header")
+
+RuleMatch = namedtuple("RuleMatch", ["category", "rule_id", "rule_type"])
+
+_ADDRESS = re.compile(r"@([\w.-]+)")
+
+# \1-\99, (?P=name) and (?(group)...) not preceded by an escaping backslash
+_BACKREFERENCE = re.compile(r"(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?P=|\(\?\()")
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher: one pass over the text for any number of keywords."""
+
+    def __init__(self, patterns):
+        # patterns: [(keyword, value)]
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+        for keyword, value in patterns:
+            node = 0
+            for ch in keyword:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(value)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0) if self.goto[f].get(ch, 0) != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def best(self, text):
+        """Smallest value among all keywords found in text, or None."""
+        best = None
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for value in self.out[node]:
+                if best is None or value < best:
+                    best = value
+        return best
+
+
+def _combined_regex(patterns):
+    """Prefilter alternation plus the per-rule regexes in rank order; (None, []) if empty.
+
+    The alternation only answers "does any rule match"; finditer over it
+    would miss a better-ranked rule whose match overlaps one it consumed,
+    so on a hit the rules are tried one by one, best rank first.
+    """
+    if not patterns:
+        return None, []
+    ranked = sorted(
+        ((re.compile(pattern, re.IGNORECASE), value) for pattern, value in patterns),
+        key=lambda item: item[1]
+    )
+    combined = re.compile("|".join(f"(?:{pattern})" for pattern, _ in patterns), re.IGNORECASE)
+    return combined, ranked
+
+
+class CompiledRules:
+    """One tenant's rules compiled into a domain map, keyword automaton and combined regexes.
+
+    Rules are ranked by position (earlier wins); every matcher reports the
+    best-ranked rule it finds, and the best across matchers is returned.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.domains = {}
+        keywords = []
+        regexes = []
+        headers = {}
+
+        for rank, rule in enumerate(rules):
+            pattern = rule["pattern"]
+            if rule["type"] == "domain":
+                self.domains.setdefault(pattern.lower().lstrip("@."), rank)
+            elif rule["type"] == "keyword":
+                keywords.append((pattern.lower(), rank))
+            elif rule["type"] == "regex":
+                regexes.append((pattern, rank))
+            elif rule["type"] == "header":
+                headers.setdefault(rule["header"].lower(), []).append((pattern, rank))
+
+        self.keywords = AhoCorasick(keywords) if keywords else None
+        self.regex = _combined_regex(regexes)
+        self.headers = {name: _combined_regex(patterns) for name, patterns in headers.items()}
+
+    def _domain_rank(self, sender):
+        match = _ADDRESS.search(sender)
+        if not match:
+            return None
+        labels = match.group(1).split(".")
+        # Exact domain first, then each parent domain: O(number of labels)
+        ranks = [
+            self.domains[".".join(labels[i:])]
+            for i in range(len(labels))
+            if ".".join(labels[i:]) in self.domains
+        ]
+        return min(ranks) if ranks else None
+
+    @staticmethod
+    def _regex_rank(compiled, text):
+        combined, ranked = compiled
+        if combined is None or not text or not combined.search(text):
+            return None
+        for regex, rank in ranked:
+            if regex.search(text):
+                return rank
+        return None
+
+    def match(self, sender, headers=None):
+        sender = (sender or "").lower()
+        ranks = [
+            self._domain_rank(sender) if self.domains else None,
+            self.keywords.best(sender) if self.keywords else None,
+            self._regex_rank(self.regex, sender),
+        ]
+        for name, value in (headers or {}).items():
+            compiled = self.headers.get(name.lower())
+            if compiled:
+                ranks.append(self._regex_rank(compiled, value))
+
+        ranks = [r for r in ranks if r is not None]
+        if not ranks:
+            return None
+        rule = self.rules[min(ranks)]
+        return RuleMatch(rule["category"], rule["id"], rule["type"])
+
+
+def _valid(rule):
+    if rule.get("type") not in RULE_TYPES or not rule.get("pattern") or not rule.get("category"):
+        return False
+    if rule["type"] == "header" and not rule.get("header"):
+        return False
+    if rule["type"] in ("regex", "header"):
+        pattern = rule["pattern"]
+        # Patterns are joined into one alternation: group names, backreferences
+        # and inline global flags would clash with or change the other rules
+        if _BACKREFERENCE.search(pattern):
+            return False
+        try:
+            if re.compile(pattern).groupindex:
+                return False
+            re.compile(f"(?:{pattern})|(?:{pattern})")
+        except re.error:
+            return False
+    return True
+
+
+def _load_file_rules():
+    if not os.path.exists(SENDER_RULES_PATH):
+        return []
+    with open(SENDER_RULES_PATH) as f:
+        return json.load(f)
+
+
+def _load_db_rules():
+    # Imported lazily: the database package imports this one
+    from database.database import SessionLocal
+    from database.models import SenderRule
+
+    db = SessionLocal()
+    try:
+        rows = db.query(SenderRule).filter(SenderRule.enabled == True).order_by(
+            SenderRule.priority, SenderRule.id
+        ).all()
+    except Exception:
+        # Table not created yet
+        return []
+    finally:
+        db.close()
+
+    return [
+        {
+            "id": f"db-{r.id}",
+            "user_email": r.user_email,
+            "type": r.rule_type,
+            "pattern": r.pattern,
+            "header": r.header,
+            "category": r.category,
+            "priority": r.priority
+        }
+        for r in rows
+    ]
+
+
+class SenderRuleEngine:
+    """Per-tenant compiled rule sets, recompiled when the rule sources change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compiled = {}
+        self._signature = None
+        self._checked_at = 0
+
+    def _build(self, rules):
+        """Compile global rules and, per tenant, that tenant's rules ahead of the global ones."""
+        invalid = [r for r in rules if not _valid(r)]
+        for rule in invalid:
+            print(f"⚠️ Skipping invalid sender rule {rule.get('id', rule.get('pattern'))}")
+        rules = [r for r in rules if _valid(r)]
+        for i, rule in enumerate(rules):
+            rule.setdefault("id", f"rule-{i}")
+        rules.sort(key=lambda r: r.get("priority", 100))
+
+        global_rules = [r for r in rules if not r.get("user_email")]
+        tenants = {r["user_email"] for r in rules if r.get("user_email")}
+
+        compiled = {None: CompiledRules(global_rules)}
+        for tenant in tenants:
+            tenant_rules = [r for r in rules if r.get("user_email") == tenant]
+            compiled[tenant] = CompiledRules(tenant_rules + global_rules)
+        return compiled
+
+    def reload(self, force=False):
+        """Reload rules if the file or DB rules changed; returns the number of rules loaded."""
+        file_rules = _load_file_rules()
+        db_rules = _load_db_rules()
+        rules = DEFAULT_RULES + file_rules + db_rules
+        signature = json.dumps(rules, sort_keys=True, default=str)
+
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if force or signature != self._signature:
+                self._compiled = self._build([dict(r) for r in rules])
+                self._signature = signature
+        return len(rules)
+
+    def match(self, sender, user_email=None, headers=None):
+        if time.monotonic() - self._checked_at > SENDER_RULES_RELOAD_SECONDS or not self._compiled:
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"⚠️ Could not reload sender rules: {e}")
+                if not self._compiled:
+                    self._compiled = self._build([dict(r) for r in DEFAULT_RULES])
+
+        compiled = self._compiled.get(user_email) or self._compiled[None]
+        return compiled.match(sender, headers)
+
+
+sender_rule_engine = SenderRuleEngine()
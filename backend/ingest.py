@@ -0,0 +1,212 @@
+# ingest.py
+from email_summarizer.email_summarizer import (
+    get_emails_details_batch,
+    get_emails_metadata_batch,
+    infer_category_from_sender,
+    categorize_locally,
+    summarize_email,
+    smart_categorize_emails,
+    LAZY_BODY_FETCH
+)
+from email_summarizer.local_classifier import get_local_classifier
+from database.helpers import save_emails, get_known_emails, get_snippet_body_ids, replace_snippet_bodies
+from utils.metrics import stage
+import datetime
+import os
+import threading
+
+# Unseen messages fetched (and streamed out) per step
+INGEST_STREAM_CHUNK_SIZE = int(os.getenv("INGEST_STREAM_CHUNK_SIZE", "25"))
+
+# Snippet-only bodies fetched per user per backfill run, and where each user's walk stands
+BODY_BACKFILL_BATCH = int(os.getenv("BODY_BACKFILL_BATCH", "200"))
+# Only emails saved within this many days are backfilled (0 turns backfill off).
+# A backfilled email is downloaded twice, metadata then full, so the window caps
+# the extra Gmail transfer; older emails keep their snippet for search and display.
+BODY_BACKFILL_MAX_AGE_DAYS = int(os.getenv("BODY_BACKFILL_MAX_AGE_DAYS", "3"))
+_backfill_cursor = {}
+
+# One ingest at a time per user, shared by the scheduler and /fetch-emails
+_user_locks = {}
+_user_locks_guard = threading.Lock()
+
+
+def user_ingest_lock(user_email):
+    with _user_locks_guard:
+        lock = _user_locks.get(user_email)
+        if lock is None:
+            lock = _user_locks[user_email] = threading.Lock()
+        return lock
+
+
+def fetch_new_emails(service, msg_ids, user_email=None):
+    """Two-tier fetch of unseen messages; returns {msg_id: parsed email dict}.
+
+    Tier 1 pulls headers, snippet and attachment metadata without body
+    data. The full body is fetched only for messages that neither the
+    sender rules nor the local model can categorize (the LLM needs it);
+    the rest are saved with the snippet, flagged ``snippet_only``, and
+    recent ones get their full body from backfill_snippet_bodies() later.
+    Messages the local model was asked about carry its answer (or None)
+    as ``local_category``, so categorization doesn't run it again.
+    """
+    if not LAZY_BODY_FETCH:
+        with stage("gmail_full", messages=len(msg_ids)):
+            full = get_emails_details_batch(service, msg_ids)
+        metadata = {}
+        checked = local = {}
+    else:
+        with stage("gmail_metadata", messages=len(msg_ids)):
+            metadata = get_emails_metadata_batch(service, msg_ids)
+        with stage("prefilter", messages=len(metadata)) as info:
+            undecided = [
+                {"email_id": msg_id, "sender": metadata[msg_id][0], "subject": metadata[msg_id][1], "body": metadata[msg_id][2]}
+                for msg_id in msg_ids
+                if msg_id in metadata
+                and infer_category_from_sender(metadata[msg_id][0], user_email, metadata[msg_id][5]) is None
+            ]
+            local = categorize_locally(undecided)
+            checked = {e["email_id"] for e in undecided}
+            needs_body = [e["email_id"] for e in undecided if e["email_id"] not in local]
+            info["needs_body"] = len(needs_body)
+        with stage("gmail_full", messages=len(needs_body)):
+            full = get_emails_details_batch(service, needs_body) if needs_body else {}
+
+    parsed = {}
+    for msg_id in msg_ids:
+        headers = metadata[msg_id][5] if msg_id in metadata else None
+        snippet_only = msg_id not in full
+        if not snippet_only:
+            sender, subject, body, thread_id, attachments = full[msg_id]
+        elif msg_id in metadata:
+            sender, subject, body, thread_id, attachments = metadata[msg_id][:5]
+        else:
+            continue
+
+        parsed[msg_id] = {
+            "email_id": msg_id,
+            "sender": sender,
+            "subject": subject,
+            "body": body,
+            "thread_id": thread_id,
+            "attachments": attachments,
+            "headers": headers,
+            "snippet_only": snippet_only
+        }
+        if msg_id in checked:
+            parsed[msg_id]["local_category"] = local.get(msg_id)
+    return parsed
+
+
+def backfill_snippet_bodies(service, user_email, limit=None):
+    """Fetch full bodies for up to ``limit`` recent emails saved with only their snippet.
+
+    Walks the user's snippet-only emails from the last
+    BODY_BACKFILL_MAX_AGE_DAYS in ID order across calls, so messages Gmail
+    can no longer return don't block the rest. Returns the number of
+    bodies replaced.
+    """
+    if BODY_BACKFILL_MAX_AGE_DAYS <= 0:
+        return 0
+    limit = limit or BODY_BACKFILL_BATCH
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=BODY_BACKFILL_MAX_AGE_DAYS)
+    ids = get_snippet_body_ids(user_email, after=_backfill_cursor.get(user_email), limit=limit, since=since)
+    if not ids:
+        _backfill_cursor.pop(user_email, None)
+        return 0
+    _backfill_cursor[user_email] = ids[-1] if len(ids) == limit else None
+
+    with stage("body_backfill", messages=len(ids)) as info:
+        full = get_emails_details_batch(service, ids)
+        replace_snippet_bodies({msg_id: details[2] for msg_id, details in full.items()})
+        info["fetched"] = len(full)
+    return len(full)
+
+
+def _listing_entry(e):
+    return {
+        "email_id": e["email_id"],
+        "from": e["sender"],
+        "subject": e["subject"],
+        "summary": e["summary"]
+    }
+
+
+def iter_fetch_and_save_emails(service, user_email, messages, chunk_size=None, saved=None):
+    """Fetch, summarize, categorize and save listed messages, yielding progress events.
+
+    Yields (event, data) pairs in pipeline order:
+      - ("email", {email_id, from, subject, summary}) for every listed email:
+        known ones straight from the DB, new ones as soon as their fetch
+        chunk is parsed and summarized;
+      - ("category", {email_id, category}) for new emails, after one
+        categorization pass over all of them and the batch has been saved.
+
+    If ``saved`` is a set it is filled with the IDs of the rows actually
+    inserted (not known emails, nor ones a concurrent writer got to first).
+    """
+    chunk_size = chunk_size or INGEST_STREAM_CHUNK_SIZE
+
+    with stage("known_lookup", messages=len(messages)):
+        known = get_known_emails([msg["id"] for msg in messages])
+    for msg in messages:
+        if msg["id"] in known:
+            yield "email", known[msg["id"]]
+
+    unseen = [msg["id"] for msg in messages if msg["id"] not in known]
+    parsed = []
+    for i in range(0, len(unseen), chunk_size):
+        fetched = fetch_new_emails(service, unseen[i:i + chunk_size], user_email)
+        with stage("summarize", emails=len(fetched)):
+            for e in fetched.values():
+                e["summary"] = summarize_email(e["subject"], e["body"])
+        for e in fetched.values():
+            parsed.append(e)
+            yield "email", _listing_entry(e)
+
+    if not parsed:
+        return
+
+    # One categorization pass (rules, then batched LLM calls) for all new emails
+    category_sources = {}
+    with stage("categorize", emails=len(parsed)):
+        categories = smart_categorize_emails(
+            parsed, user_email, sources=category_sources,
+            local={e["email_id"]: e["local_category"] for e in parsed if "local_category" in e}
+        )
+
+    # Local priority guess until the AI analysis (or feedback) says otherwise
+    with stage("local_priority", emails=len(parsed)):
+        model = get_local_classifier()
+        priorities = model.predict_confident("priority", parsed) if model else [None] * len(parsed)
+
+    for e, priority in zip(parsed, priorities):
+        e["priority"] = priority or "Medium"
+        e["priority_source"] = "local" if priority else "default"
+        e["category"] = categories.get(e["email_id"])
+        e["category_source"] = category_sources.get(e["email_id"])
+
+    # One transaction for the whole batch, before anything waits on the consumer
+    inserted = save_emails(user_email, parsed)
+    if saved is not None:
+        saved.update(inserted)
+
+    for e in parsed:
+        yield "category", {"email_id": e["email_id"], "category": e["category"]}
+
+
+def fetch_and_save_emails(service, user_email, messages, saved=None):
+    """Fetch listed messages in bulk, summarize and save them.
+
+    Messages already in the DB are not fetched again; only unseen IDs go
+    through the two-tier fetch, categorization and threading. Returns all
+    listed emails in listing order as dicts with
+    email_id / from / subject / summary; ``saved`` is filled as in
+    iter_fetch_and_save_emails.
+    """
+    emails = {}
+    for event, data in iter_fetch_and_save_emails(service, user_email, messages, saved=saved):
+        if event == "email":
+            emails[data["email_id"]] = data
+
+    return [emails[msg["id"]] for msg in messages if msg["id"] in emails]
@@ -2,59 +2,226 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from email_summarizer.email_summarizer import (
     authenticate_gmail,
     get_last_24h_emails,
-    get_email_details,
-    summarize_email,
-    analyze_emails_with_ai
+    get_current_history_id,
+    get_messages_since
 )
 from database.database import SessionLocal
-from database.models import Email,EmailAttachment
-from database.helpers import save_email
+from database.models import Email
+from database.helpers import (
+    get_history_id,
+    set_history_id,
+    get_failed_message_ids,
+    train_local_classifier,
+    recluster_smart_threads
+)
+from ingest import fetch_and_save_emails, backfill_snippet_bodies, user_ingest_lock
+from utils.metrics import REGISTRY, log_event
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
 import os
+import threading
+import time
+
+# Users are ingested concurrently, at most INGEST_MAX_WORKERS at a time
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "8"))
+INGEST_INTERVAL_MINUTES = int(os.getenv("INGEST_INTERVAL_MINUTES", "5"))
+LOCAL_MODEL_RETRAIN_HOURS = int(os.getenv("LOCAL_MODEL_RETRAIN_HOURS", "6"))
+SMART_THREAD_RECLUSTER_HOURS = int(os.getenv("SMART_THREAD_RECLUSTER_HOURS", "24"))
+
+# How often recent bodies stored as Gmail snippets are replaced by the full body
+# (see BODY_BACKFILL_MAX_AGE_DAYS in ingest)
+BODY_BACKFILL_MINUTES = int(os.getenv("BODY_BACKFILL_MINUTES", "30"))
+
+# A message that keeps failing to fetch is dropped after this many syncs
+SYNC_MAX_ATTEMPTS = int(os.getenv("SYNC_MAX_ATTEMPTS", "5"))
+
+_cycle_lock = threading.Lock()
+
+# Timing of the last completed cycle: {"duration": s, "users": {user_email: s}}
+last_cycle = {}
+
+CYCLE_SECONDS = REGISTRY.histogram("mail_scheduler_cycle_seconds", "Duration of auto-fetch cycles.")
+CYCLES_SKIPPED = REGISTRY.counter("mail_scheduler_cycles_skipped_total", "Ticks skipped because a cycle was still running.")
+USER_SECONDS = REGISTRY.histogram("mail_ingest_user_seconds", "Duration of one user's ingest.")
+SLOWEST_USER_SECONDS = REGISTRY.gauge("mail_ingest_slowest_user_seconds", "Longest single-user ingest in the last cycle.")
+USER_FAILURES = REGISTRY.counter("mail_ingest_user_failures_total", "Failed user ingests.")
+INGESTED_MESSAGES = REGISTRY.counter("mail_ingest_messages_total", "New messages saved by the scheduler.")
+
+
+def get_new_messages(service, user_email):
+    """List messages added since the user's last sync.
+
+    Returns (messages, history_id). Falls back to a full 24h re-list when
+    there is no stored historyId or Gmail has expired it.
+    """
+    history_id = get_history_id(user_email)
+    if history_id:
+        messages, latest_history_id = get_messages_since(service, history_id)
+        if messages is not None:
+            return messages, latest_history_id
+        print(f"⚠️ History {history_id} expired for {user_email}, running full resync")
+
+    # Take the history id before listing so nothing added in between is missed
+    latest_history_id = get_current_history_id(service)
+    return get_last_24h_emails(service, max_results=None), latest_history_id
+
+
+def ingest_user(user_email):
+    """Sync one user's mailbox; returns (new messages saved, seconds) or None if skipped."""
+    lock = user_ingest_lock(user_email)
+    if not lock.acquire(blocking=False):
+        print(f"⏭️ {user_email} is already being ingested, skipping")
+        return None
+
+    started = time.perf_counter()
+    try:
+        service = authenticate_gmail(user_email)
+        messages, history_id = get_new_messages(service, user_email)
+
+        # The historyId moves past these, so retry them explicitly
+        failed = get_failed_message_ids(user_email)
+        listed = {msg["id"] for msg in messages}
+        messages = messages + [{"id": msg_id} for msg_id in failed if msg_id not in listed]
+
+        still_failed = {}
+        saved = set()
+        if messages:
+            fetched = {e["email_id"] for e in fetch_and_save_emails(service, user_email, messages, saved=saved)}
+            for msg in messages:
+                if msg["id"] in fetched:
+                    continue
+                attempts = failed.get(msg["id"], 0) + 1
+                if attempts >= SYNC_MAX_ATTEMPTS:
+                    print(f"⚠️ Giving up on message {msg['id']} for {user_email} after {attempts} attempts")
+                else:
+                    still_failed[msg["id"]] = attempts
+
+        set_history_id(user_email, history_id, still_failed)
+    finally:
+        lock.release()
+
+    return len(saved), time.perf_counter() - started
+
 
 def auto_fetch_emails():
-    print("⏳ Running auto-fetch job...")
+    # Skip the tick entirely if the previous cycle is still running
+    if not _cycle_lock.acquire(blocking=False):
+        print("⏭️ Previous auto-fetch cycle still running, skipping")
+        CYCLES_SKIPPED.inc()
+        return
 
-    db = SessionLocal()
+    try:
+        print("⏳ Running auto-fetch job...")
+        started = time.perf_counter()
+
+        db = SessionLocal()
 
-    # Get list of all users (unique user_email from Email table)
+        # Get list of all users (unique user_email from Email table)
+        users = db.query(Email.user_email).distinct().all()
+        db.close()
+
+        durations = {}
+        with ThreadPoolExecutor(max_workers=INGEST_MAX_WORKERS) as pool:
+            futures = {pool.submit(ingest_user, user_email): user_email for (user_email,) in users}
+            for future in as_completed(futures):
+                user_email = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ Auto-fetch failed for {user_email}: {e}")
+                    USER_FAILURES.inc()
+                    log_event("ingest_user", user=user_email, error=str(e))
+                    continue
+                if result:
+                    count, seconds = result
+                    durations[user_email] = round(seconds, 3)
+                    print(f"📩 {user_email}: {count} new messages saved in {seconds:.2f}s")
+                    USER_SECONDS.observe(seconds)
+                    INGESTED_MESSAGES.inc(count)
+                    log_event("ingest_user", user=user_email, messages=count, seconds=round(seconds, 3))
+
+        last_cycle.update({
+            "duration": round(time.perf_counter() - started, 3),
+            "users": durations
+        })
+        SLOWEST_USER_SECONDS.set(max(durations.values(), default=0))
+        print(f"✅ Auto-fetch cycle completed in {last_cycle['duration']:.2f}s")
+        CYCLE_SECONDS.observe(last_cycle["duration"])
+        log_event("ingest_cycle", users=len(durations), seconds=last_cycle["duration"])
+    finally:
+        _cycle_lock.release()
+
+
+def retrain_local_classifier():
+    started = time.perf_counter()
+    try:
+        trained = train_local_classifier()
+    except Exception as e:
+        print(f"❌ Local classifier training failed: {e}")
+        return
+    if trained:
+        print(f"🧠 Local classifier trained on {trained} in {time.perf_counter() - started:.1f}s")
+
+
+def recluster_all_smart_threads():
+    """Re-cluster every user's smart threads, skipping users being ingested."""
+    db = SessionLocal()
     users = db.query(Email.user_email).distinct().all()
     db.close()
 
     for (user_email,) in users:
-        print(f"📩 Auto-fetching emails for {user_email}")
-
+        lock = user_ingest_lock(user_email)
+        if not lock.acquire(blocking=False):
+            print(f"⏭️ {user_email} is being ingested, re-clustering next time")
+            continue
         try:
-            service = authenticate_gmail(user_email)
+            result = recluster_smart_threads(user_email)
         except Exception as e:
-            print(f"❌ Failed to authenticate {user_email}: {e}")
-            continue
-
-        messages = get_last_24h_emails(service)
-
-        if not messages:
+            print(f"❌ Smart thread re-clustering failed for {user_email}: {e}")
             continue
+        finally:
+            lock.release()
+        print(f"🧵 {user_email}: {result['emails']} emails in {result['threads']} smart threads, {result['changed']} moved")
 
-        for msg in messages:
-            sender, subject, body, thread_id, attachments = get_email_details(service, msg["id"])
-            summary = summarize_email(subject, body)
 
-            save_email(
-                email_id=msg["id"],
-                user_email=user_email,
-                sender=sender,
-                subject=subject,
-                body=body,
-                summary=summary,
-                priority="Medium",
-                thread_id=thread_id,
-                attachments=attachments
-            )
+def backfill_email_bodies():
+    """Fetch full bodies for emails the lazy fetch saved with only a snippet."""
+    db = SessionLocal()
+    users = db.query(Email.user_email).distinct().all()
+    db.close()
 
-    print("✅ Auto-fetch cycle completed")
+    for (user_email,) in users:
+        lock = user_ingest_lock(user_email)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            fetched = backfill_snippet_bodies(authenticate_gmail(user_email), user_email)
+        except Exception as e:
+            print(f"❌ Body backfill failed for {user_email}: {e}")
+            continue
+        finally:
+            lock.release()
+        if fetched:
+            print(f"📄 {user_email}: {fetched} full bodies backfilled")
 
 
 def start_scheduler():
     scheduler = BackgroundScheduler()
-    scheduler.add_job(auto_fetch_emails, "interval", minutes=5)  # fetch every 5 minutes
+    scheduler.add_job(
+        auto_fetch_emails, "interval", minutes=INGEST_INTERVAL_MINUTES,
+        max_instances=1, coalesce=True
+    )
+    scheduler.add_job(
+        retrain_local_classifier, "interval", hours=LOCAL_MODEL_RETRAIN_HOURS,
+        next_run_time=datetime.datetime.now(), max_instances=1, coalesce=True
+    )
+    scheduler.add_job(
+        backfill_email_bodies, "interval", minutes=BODY_BACKFILL_MINUTES,
+        max_instances=1, coalesce=True
+    )
+    scheduler.add_job(
+        recluster_all_smart_threads, "interval", hours=SMART_THREAD_RECLUSTER_HOURS,
+        max_instances=1, coalesce=True
+    )
     scheduler.start()
-    print("🚀 APScheduler Started (fetching every 5 min)")
+    print(f"🚀 APScheduler Started (fetching every {INGEST_INTERVAL_MINUTES} min, {INGEST_MAX_WORKERS} workers)")
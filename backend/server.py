@@ -1,36 +1,113 @@
 # server.py
 from fastapi import FastAPI, Request, Form, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from functools import partial
 from sqlalchemy.orm import Session
 from google_auth_oauthlib.flow import Flow
-from email_summarizer.email_summarizer import categorize_email_with_ai 
-from scheduler import start_scheduler
-from database.helpers import save_email, assign_smart_thread_id
-from database.models import Email, EmailAttachment
+from scheduler import start_scheduler, INGEST_MAX_WORKERS
+from ingest import fetch_and_save_emails, iter_fetch_and_save_emails, user_ingest_lock
+from database.helpers import update_email_priorities, recluster_smart_threads
+from attachments import open_attachment
+from utils.attachment_store import iter_file
+from urllib.parse import quote
+from database.models import EmailAttachment
 import os
 import json
-import requests
-import base64
+import time
+import asyncio
+import anyio
+import httpx
 
 # Gmail summarizer functions
 from email_summarizer.email_summarizer import (
     authenticate_gmail,
+    invalidate_gmail_cache,
     get_last_24h_emails,
-    get_email_details,
-    summarize_email,
-    analyze_emails_with_ai
+    analyze_emails_with_ai,
+    analyze_emails_with_ai_async,
+    match_sender_rule
 )
+from email_summarizer.sender_rules import sender_rule_engine
 
 # ORM imports
-from database.database import Base, engine, get_db, SessionLocal
-from database.models import Feedback, Email
+from database.database import get_db, DB_POOL_SIZE, DB_MAX_OVERFLOW
+from database.models import Feedback
+from database.search import full_text_search
+from database.queries import grouped_emails, group_key_expression, category_counts
+from database.schema import init_db
+from utils.metrics import REGISTRY, stage
 
 # Create tables automatically
-Base.metadata.create_all(bind=engine)
+init_db()
 
-app = FastAPI()
+# Worker threads for blocking work (Gmail, DB); anyio's default is 40
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "64"))
+
+# Requests running at once per endpoint group; the rest wait on the event loop
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "8"))
+# Shared by every DB-backed endpoint; the rest of the pool stays free for the
+# fetch pipelines and the scheduler's ingest workers
+DB_CONCURRENCY = int(os.getenv(
+    "DB_CONCURRENCY",
+    str(max(1, DB_POOL_SIZE + DB_MAX_OVERFLOW - FETCH_CONCURRENCY - INGEST_MAX_WORKERS))
+))
+
+
+# Streaming fetch pipelines still running; shutdown waits for them to finish saving
+_stream_tasks = set()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    yield
+    if _stream_tasks:
+        print(f"⏳ Waiting for {len(_stream_tasks)} streaming fetches to finish")
+        await asyncio.gather(*_stream_tasks, return_exceptions=True)
+
+
+def concurrency_limit(semaphore):
+    """Route dependency capping how many requests run at once under ``semaphore``."""
+    async def limited():
+        async with semaphore:
+            yield
+
+    return Depends(limited)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the worker threadpool instead of the event loop."""
+    return await anyio.to_thread.run_sync(partial(fn, *args, **kwargs))
+
+
+# Gmail + LLM pipelines share one limit, DB-backed endpoints share another
+fetch_semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+fetch_limit = concurrency_limit(fetch_semaphore)
+db_limit = concurrency_limit(asyncio.Semaphore(DB_CONCURRENCY))
+
+app = FastAPI(lifespan=lifespan)
 start_scheduler()
 
+HTTP_SECONDS = REGISTRY.histogram(
+    "mail_http_request_seconds", "API latency until response headers.", ["method", "route", "status"]
+)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=route.path if route else "unmatched",
+        status=response.status_code
+    )
+    return response
+
 # Gmail scopes
 SCOPES = [
     "https://www.googleapis.com/auth/gmail.readonly",
@@ -39,6 +116,9 @@ SCOPES = [
     "https://www.googleapis.com/auth/userinfo.profile"
 ]
 
+# Emails listed per /fetch-emails call (Gmail allows up to 500 per page)
+FETCH_EMAILS_LIMIT = int(os.getenv("FETCH_EMAILS_LIMIT", "200"))
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -54,6 +134,12 @@ def root():
     return {"message": "mAiL API is running 🚀"}
 
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus text-format metrics"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/login-url")
 def login_url():
     """Generate Gmail OAuth URL"""
@@ -70,15 +156,22 @@ def login_url():
     return {"auth_url": auth_url}
 
 
+def _save_token(user_email, creds):
+    os.makedirs("tokens", exist_ok=True)
+    with open(f"tokens/{user_email}.json", "w") as token_file:
+        token_file.write(creds.to_json())
+    invalidate_gmail_cache(user_email)
+
+
 @app.get("/auth/callback")
-def auth_callback(code: str):
+async def auth_callback(code: str):
     """Google OAuth callback"""
     flow = Flow.from_client_secrets_file(
         'credentials.json',
         scopes=SCOPES,
         redirect_uri='http://localhost:8000/auth/callback'
     )
-    flow.fetch_token(code=code)
+    await run_blocking(flow.fetch_token, code=code)
     creds = flow.credentials
 
     user_email = None
@@ -86,10 +179,11 @@ def auth_callback(code: str):
         if creds.id_token and "email" in creds.id_token:
             user_email = creds.id_token["email"]
         else:
-            response = requests.get(
-                "https://www.googleapis.com/oauth2/v3/userinfo",
-                headers={"Authorization": f"Bearer {creds.token}"}
-            )
+            async with httpx.AsyncClient(timeout=10) as http:
+                response = await http.get(
+                    "https://www.googleapis.com/oauth2/v3/userinfo",
+                    headers={"Authorization": f"Bearer {creds.token}"}
+                )
             user_email = response.json().get("email", "unknown")
     except Exception as e:
         return {"error": f"Failed to fetch user info: {str(e)}"}
@@ -97,70 +191,55 @@ def auth_callback(code: str):
     if not creds.refresh_token:
         print("⚠️ Missing refresh_token. User must re-consent next login.")
 
-    os.makedirs("tokens", exist_ok=True)
-    with open(f"tokens/{user_email}.json", "w") as token_file:
-        token_file.write(creds.to_json())
+    await run_blocking(_save_token, user_email, creds)
 
     print(f"✅ Logged in as: {user_email}")
     return {"success": True, "user_email": user_email}
 
 
-def update_email_priority(email_id, new_priority):
-    db = SessionLocal()
-    email_obj = db.query(Email).filter(Email.email_id == email_id).first()
-    if email_obj:
-        email_obj.priority = new_priority
-        db.commit()
-    db.close()
+def _ingest_locked(service, user_email, messages):
+    with user_ingest_lock(user_email):
+        return fetch_and_save_emails(service, user_email, messages)
 
 
-@app.get("/fetch-emails")
-def fetch_emails(user_email: str):
+def _apply_priorities(emails, ai_data):
+    """Set and store each email's priority from the AI analysis; ones it left out get "Medium"."""
+    priorities = {p["email_id"]: p["priority"] for p in ai_data["priorities"]}
+    for email in emails:
+        email["priority"] = priorities.get(email["email_id"], "Medium")
+
+    update_email_priorities(
+        {e["email_id"]: e["priority"] for e in emails if e["email_id"] in priorities}, source="llm"
+    )
+    update_email_priorities(
+        {e["email_id"]: e["priority"] for e in emails if e["email_id"] not in priorities}, source="default"
+    )
+
+
+@app.get("/fetch-emails", dependencies=[fetch_limit])
+async def fetch_emails(user_email: str):
     """Fetch last 24h Gmail emails and summarize"""
     token_path = f"tokens/{user_email}.json"
     if not os.path.exists(token_path):
         return {"error": f"No token found for {user_email}. Please re-login."}
 
     try:
-        service = authenticate_gmail(user_email)
+        service = await run_blocking(authenticate_gmail, user_email)
     except Exception as e:
         return {"error": "Authentication failed. Please re-login.", "details": str(e)}
     
-    messages = get_last_24h_emails(service)
+    with stage("gmail_list"):
+        messages = await run_blocking(get_last_24h_emails, service, max_results=FETCH_EMAILS_LIMIT)
     if not messages:
         return {"overall_summary": "No new emails in last 24 hours", "emails": []}
 
-    emails = []
-    for msg in messages[:15]:
-        sender, subject, body, thread_id, attachments = get_email_details(service, msg['id'])
-        summary = summarize_email(subject, body)
-        emails.append({
-            "email_id": msg["id"],
-            "from": sender,
-            "subject": subject,
-            "summary": summary
-        })
-
-        save_email(
-        email_id=msg["id"],
-        user_email=user_email,
-        sender=sender,
-        subject=subject,
-        body=body,
-        summary=summary,
-        priority="Medium", 
-        thread_id=thread_id,
-        attachments=attachments
-        )
-
-    ai_data = analyze_emails_with_ai(emails)
+    with stage("ingest", messages=len(messages)):
+        emails = await run_blocking(_ingest_locked, service, user_email, messages)
 
-    for email in emails:
-        match = next((p for p in ai_data["priorities"] if p["subject"] == email["subject"]), None)
-        final_priority = match["priority"] if match else "Medium"
-        email["priority"] = final_priority
+    with stage("ai_analysis", emails=len(emails)):
+        ai_data = await analyze_emails_with_ai_async(emails)
 
-        update_email_priority(email["email_id"], final_priority)
+    await run_blocking(_apply_priorities, emails, ai_data)
 
     return {
         "overall_summary": ai_data["overall_summary"],
@@ -168,94 +247,217 @@ def fetch_emails(user_email: str):
     }
 
 
-@app.get("/smart-threads")
-def get_smart_threads(user_email: str, db: Session = Depends(get_db)):
-    emails = db.query(Email).filter(Email.user_email == user_email).all()
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    grouped = {}
-    for email in emails:
-        if email.smart_thread_id not in grouped:
-            grouped[email.smart_thread_id] = []
-        grouped[email.smart_thread_id].append({
-            "email_id": email.email_id,
-            "subject": email.subject,
-            "summary": email.summary,
-            "priority": email.priority,
-            "category": email.category,
-            "timestamp": email.timestamp
-        })
+
+def _ndjson_event(event, data):
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+
+_STREAM_DONE = object()
+
+
+def _start_pipeline(pipeline):
+    """Run pipeline(emit) on the worker threadpool and return an async iterator over what it emits.
+
+    The caller must hold a fetch_semaphore slot; it is released when the
+    pipeline finishes, not when the response ends. The pipeline runs to
+    completion (saving everything and releasing the ingest lock) however
+    fast the client reads, and even if it disconnects; events wait in an
+    unbounded queue until they are read.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event, data):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    async def run():
+        try:
+            await anyio.to_thread.run_sync(pipeline, emit)
+        except Exception as e:
+            print(f"❌ Streaming fetch failed: {e}")
+            events.put_nowait(("error", {"error": str(e)}))
+        finally:
+            fetch_semaphore.release()
+            events.put_nowait(_STREAM_DONE)
+
+    # Not tied to the request, so a client disconnect doesn't cancel it
+    task = asyncio.create_task(run())
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+
+    async def drain():
+        while True:
+            item = await events.get()
+            if item is _STREAM_DONE:
+                return
+            yield item
+
+    return drain()
+
+
+@app.get("/fetch-emails/stream")
+async def fetch_emails_stream(user_email: str, format: str = Query("sse", pattern="^(sse|ndjson)$")):
+    """Streaming /fetch-emails: emails as they are summarized, then categories,
+    priorities and, last, the overall summary (SSE or NDJSON)."""
+    token_path = f"tokens/{user_email}.json"
+    if not os.path.exists(token_path):
+        return {"error": f"No token found for {user_email}. Please re-login."}
+
+    # Held until the pipeline finishes rather than through a route dependency
+    await fetch_semaphore.acquire()
+    try:
+        service = await run_blocking(authenticate_gmail, user_email)
+    except Exception as e:
+        fetch_semaphore.release()
+        return {"error": "Authentication failed. Please re-login.", "details": str(e)}
+
+    def pipeline(emit):
+        messages = get_last_24h_emails(service, max_results=FETCH_EMAILS_LIMIT)
+        if not messages:
+            emit("summary", {"overall_summary": "No new emails in last 24 hours"})
+            return
+
+        emails = []
+        with user_ingest_lock(user_email):
+            for event, data in iter_fetch_and_save_emails(service, user_email, messages):
+                if event == "email":
+                    emails.append(data)
+                emit(event, data)
+
+        ai_data = analyze_emails_with_ai(emails)
+
+        _apply_priorities(emails, ai_data)
+        for email in emails:
+            emit("priority", {"email_id": email["email_id"], "priority": email["priority"]})
+
+        emit("summary", {"overall_summary": ai_data["overall_summary"]})
+
+    events = _start_pipeline(pipeline)
+
+    encode = _sse_event if format == "sse" else _ndjson_event
+
+    async def body():
+        async for event, data in events:
+            yield encode(event, data)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/smart-threads", dependencies=[db_limit])
+def get_smart_threads(
+    user_email: str,
+    cursor: str = None,
+    limit: int = Query(50, ge=1, le=200),
+    emails_per_thread: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    key_expr = group_key_expression("subject", db.get_bind().dialect.name)
+    groups, next_cursor = grouped_emails(
+        db, user_email, key_expr, cursor=cursor, limit=limit, emails_per_group=emails_per_thread
+    )
 
     thread_list = [
-        {"smart_thread_id": tid, "emails": msgs}
-        for tid, msgs in grouped.items()
+        {
+            "smart_thread_id": group["group_key"] or None,
+            "count": group["count"],
+            "emails": [
+                {
+                    "email_id": e["email_id"],
+                    "subject": e["subject"],
+                    "summary": e["summary"],
+                    "priority": e["priority"],
+                    "category": e["category"],
+                    "timestamp": e["timestamp"]
+                }
+                for e in group["emails"]
+            ]
+        }
+        for group in groups
     ]
 
-    return {"smart_threads": thread_list}
+    return {"smart_threads": thread_list, "next_cursor": next_cursor}
+
+
+def _recluster_locked(user_email):
+    with user_ingest_lock(user_email):
+        return recluster_smart_threads(user_email)
 
 
-@app.get("/threads")
+@app.post("/smart-threads/recluster", dependencies=[db_limit])
+async def recluster_smart_threads_endpoint(user_email: str):
+    """Re-cluster the user's smart threads now instead of waiting for the scheduled run."""
+    result = await run_blocking(_recluster_locked, user_email)
+    return {"status": "reclustered", **result}
+
+
+@app.get("/threads", dependencies=[db_limit])
 def get_threads(
     user_email: str,
     mode: str = "subject",     # default threading
+    cursor: str = None,
+    limit: int = Query(50, ge=1, le=200),
+    emails_per_group: int = Query(50, ge=1, le=500),
     db: Session = Depends(get_db)
 ):
-    emails = db.query(Email).filter(Email.user_email == user_email).all()
-    if not emails:
-        return {"threads": []}
-
-    grouped = {}
+    # Grouping happens in SQL; "subject" uses the smart thread assigned at insert
+    key_expr = group_key_expression(mode, db.get_bind().dialect.name)
+    groups, next_cursor = grouped_emails(
+        db, user_email, key_expr, cursor=cursor, limit=limit, emails_per_group=emails_per_group
+    )
 
-    for email in emails:
-        if mode == "subject":
-            key = assign_smart_thread_id(email.subject)
-        elif mode == "category":
-            key = email.category or "Uncategorized"
-        elif mode == "priority":
-            key = email.priority or "Medium"
-        elif mode == "sender":
-            key = email.sender.split("<")[0].strip()   # clean sender name
-        elif mode == "date":
-            key = email.timestamp.date()
-        else:
-            key = "Other"
-
-        if key not in grouped:
-            grouped[key] = []
-
-        grouped[key].append({
-            "email_id": email.email_id,
-            "sender": email.sender,
-            "subject": email.subject,
-            "summary": email.summary,
-            "priority": email.priority,
-            "category": email.category,
-            "thread_id": email.thread_id,
-            "timestamp": email.timestamp
-        })
-
-    # Convert dict → list for clean JSON output
+    # Convert groups → list for clean JSON output
     thread_list = [
-        {"group_key": str(key), "emails": msgs}
-        for key, msgs in grouped.items()
+        {
+            "group_key": str(group["group_key"]),
+            "count": group["count"],
+            "emails": [
+                {
+                    "email_id": e["email_id"],
+                    "sender": e["sender"],
+                    "subject": e["subject"],
+                    "summary": e["summary"],
+                    "priority": e["priority"],
+                    "category": e["category"],
+                    "thread_id": e["thread_id"],
+                    "timestamp": e["timestamp"]
+                }
+                for e in group["emails"]
+            ]
+        }
+        for group in groups
     ]
 
-    return {"threads": thread_list}
+    return {"threads": thread_list, "next_cursor": next_cursor}
 
 
 
-@app.get("/category-stats")
+@app.get("/category-stats", dependencies=[db_limit])
 def category_stats(user_email: str, db: Session = Depends(get_db)):
-    emails = db.query(Email).filter(Email.user_email == user_email).all()
+    return category_counts(db, user_email)
+
+
+@app.post("/sender-rules/reload")
+def reload_sender_rules():
+    """Recompile sender rules from the rules file and DB without a restart."""
+    count = sender_rule_engine.reload(force=True)
+    return {"status": "reloaded", "rules": count}
 
-    stats = {}
-    for mail in emails:
-        cat = mail.category
-        stats[cat] = stats.get(cat, 0) + 1
 
-    return stats
+@app.get("/sender-rules/match")
+def sender_rule_match(sender: str, user_email: str = None):
+    """Which sender rule (if any) fires for a sender address."""
+    match = match_sender_rule(sender, user_email=user_email)
+    return match._asdict() if match else {"category": None, "rule_id": None, "rule_type": None}
 
 
-@app.get("/attachments")
+@app.get("/attachments", dependencies=[db_limit])
 def list_attachments(email_id: str, db: Session = Depends(get_db)):
     attachments = db.query(EmailAttachment).filter(EmailAttachment.email_id == email_id).all()
     
@@ -270,40 +472,48 @@ def list_attachments(email_id: str, db: Session = Depends(get_db)):
     ]
 
 
-@app.get("/search")
+@app.get("/attachments/content", dependencies=[fetch_limit])
+async def download_attachment(email_id: str, attachment_id: str):
+    """Stream an attachment's content, fetching it from Gmail on first use."""
+    try:
+        info, f = await run_blocking(open_attachment, email_id, attachment_id)
+    except Exception as e:
+        return {"error": "Could not fetch attachment", "details": str(e)}
+    if info is None:
+        return {"error": "Attachment not found"}
+    if f is None:
+        return {"error": "Attachment was evicted while fetching, please retry"}
+
+    filename = quote(info["filename"] or "attachment")
+    return StreamingResponse(
+        iter_file(f),
+        media_type=info["mime_type"] or "application/octet-stream",
+        headers={
+            "Content-Length": str(os.fstat(f.fileno()).st_size),
+            "Content-Disposition": f"attachment; filename*=UTF-8''{filename}"
+        }
+    )
+
+
+@app.get("/search", dependencies=[db_limit])
 def search_emails(
     user_email: str,
     q: str = Query(..., description="Search text"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
     db: Session = Depends(get_db)
 ):
-    """Search emails by subject, sender, body, or summary"""
+    """Search emails by subject, sender, body, or summary (ranked, prefix matching)"""
+    return full_text_search(db, user_email, q, limit=limit, offset=offset)
 
-    query_str = f"%{q.lower()}%"
+def _save_feedback(db, email_id, priority, is_correct):
+    feedback = Feedback(email_id=email_id, priority=priority, is_correct=is_correct)
+    db.add(feedback)
+    db.commit()
+    db.refresh(feedback)
 
-    results = db.query(Email).filter(
-        Email.user_email == user_email,
-        (
-            Email.subject.ilike(query_str) |
-            Email.sender.ilike(query_str) |
-            Email.body.ilike(query_str) |
-            Email.summary.ilike(query_str) |
-            Email.priority.ilike(query_str)
-        )
-    ).all()
 
-    return [
-        {
-            "email_id": e.email_id,
-            "sender": e.sender,
-            "subject": e.subject,
-            "summary": e.summary,
-            "priority": e.priority,
-            "timestamp": e.timestamp
-        }
-        for e in results
-    ]
-
-@app.post("/feedback")
+@app.post("/feedback", dependencies=[db_limit])
 async def feedback(
     email_id: str = Form(None),
     priority: str = Form(None),
@@ -325,15 +535,12 @@ async def feedback(
     if not email_id or not priority:
         return {"success": False, "error": "Missing required fields"}
 
-    feedback = Feedback(email_id=email_id, priority=priority, is_correct=is_correct)
-    db.add(feedback)
-    db.commit()
-    db.refresh(feedback)
+    await run_blocking(_save_feedback, db, email_id, priority, is_correct)
 
     return {"success": True, "message": "Feedback saved successfully"}
 
 
-@app.get("/feedback")
+@app.get("/feedback", dependencies=[db_limit])
 def feedback_list(db: Session = Depends(get_db)):
     """Return all feedback records"""
     feedbacks = db.query(Feedback).order_by(Feedback.timestamp.desc()).all()
@@ -348,7 +555,7 @@ def feedback_list(db: Session = Depends(get_db)):
     ]
 
 
-@app.get("/feedback-stats")
+@app.get("/feedback-stats", dependencies=[db_limit])
 def feedback_stats(db: Session = Depends(get_db)):
     """Get feedback statistics"""
     total = db.query(Feedback).count()
@@ -0,0 +1,154 @@
+# utils/attachment_store.py
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from utils.metrics import REGISTRY
+
+# Attachment content cache on disk, deduplicated by SHA-256
+ATTACHMENT_STORE_PATH = os.getenv("ATTACHMENT_STORE_PATH", "attachment_store")
+ATTACHMENT_STORE_MAX_BYTES = int(os.getenv("ATTACHMENT_STORE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Share of max bytes to evict down to, so evictions come in batches rather than on every put
+ATTACHMENT_STORE_LOW_WATER = float(os.getenv("ATTACHMENT_STORE_LOW_WATER", "0.9"))
+
+# Bytes per chunk when streaming a stored file
+ATTACHMENT_CHUNK_SIZE = int(os.getenv("ATTACHMENT_CHUNK_SIZE", str(64 * 1024)))
+
+STORE_HITS = REGISTRY.counter("mail_attachment_store_hits_total", "Attachment reads served from the store.")
+STORE_MISSES = REGISTRY.counter("mail_attachment_store_misses_total", "Attachment reads whose content was not in the store.")
+STORE_DEDUPED = REGISTRY.counter("mail_attachment_store_deduped_total", "Stored attachments whose content was already present.")
+STORE_EVICTIONS = REGISTRY.counter("mail_attachment_store_evictions_total", "Files evicted to stay under the size limit.")
+STORE_BYTES = REGISTRY.gauge("mail_attachment_store_bytes", "Bytes currently in the attachment store.")
+
+
+class AttachmentStore:
+    """Content-addressed files under root/<sha256[:2]>/<sha256>.
+
+    Identical content is kept once, whichever message or user it came
+    from. Reads bump a file's mtime, and once the store grows past
+    max_bytes the least recently used files are evicted down to
+    low_water * max_bytes.
+
+    Recency is tracked in memory, seeded from mtimes by one scan on first
+    use, so a put never walks the store.
+    """
+
+    def __init__(self, root=ATTACHMENT_STORE_PATH, max_bytes=ATTACHMENT_STORE_MAX_BYTES,
+                 low_water=ATTACHMENT_STORE_LOW_WATER):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._lock = threading.Lock()
+        self._size = None   # total bytes, scanned on first use
+        self._lru = OrderedDict()   # digest -> size, least recently used first
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.startswith("."):
+                    yield os.path.join(dirpath, name)
+
+    def _ensure_size(self):
+        if self._size is not None:
+            return
+        files = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, os.path.basename(path), stat.st_size))
+        for _, digest, size in sorted(files):
+            self._lru[digest] = size
+        self._size = sum(self._lru.values())
+        STORE_BYTES.set(self._size)
+
+    def _touch(self, digest):
+        with self._lock:
+            if digest in self._lru:
+                self._lru.move_to_end(digest)
+
+    def open(self, digest):
+        """Open a stored file for reading, or None if it isn't stored (or was evicted)."""
+        path = self.path(digest)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            STORE_MISSES.inc()
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted after the open; the open handle still reads it
+            pass
+        self._touch(digest)
+        STORE_HITS.inc()
+        return f
+
+    def put(self, data):
+        """Store bytes and return their SHA-256 hex digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+
+        with self._lock:
+            self._ensure_size()
+            if os.path.exists(path):
+                os.utime(path)
+                if digest not in self._lru:
+                    # Written by another process sharing the store
+                    self._lru[digest] = os.path.getsize(path)
+                    self._size += self._lru[digest]
+                self._lru.move_to_end(digest)
+                STORE_DEDUPED.inc()
+                return digest
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp name first so readers never see a partial file
+            tmp = os.path.join(os.path.dirname(path), f".{uuid.uuid4().hex}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+            # Drop any stale entry for a file another process removed
+            self._size -= self._lru.pop(digest, 0)
+            self._lru[digest] = len(data)
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+            STORE_BYTES.set(self._size)
+        return digest
+
+    def _evict(self):
+        """Delete least recently used files until the store is down to the low-water mark.
+
+        The most recent file, the one just stored, is always kept.
+        """
+        target = self.max_bytes * self.low_water
+        while self._size > target and len(self._lru) > 1:
+            digest, size = self._lru.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(self.path(digest))
+            except FileNotFoundError:
+                continue
+            STORE_EVICTIONS.inc()
+
+
+def iter_file(f, chunk_size=None):
+    """Yield an open file's content in chunks, closing it at the end."""
+    chunk_size = chunk_size or ATTACHMENT_CHUNK_SIZE
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
+attachment_store = AttachmentStore()
@@ -0,0 +1,127 @@
+import math
+import re
+import threading
+from collections import Counter
+
+# Same token rule as sklearn's TfidfVectorizer default
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+# Leading "Re:", "Fwd:", "Fw:" (possibly repeated) don't change the thread
+REPLY_PREFIX = re.compile(r"^\s*((re|fwd?|aw|sv)\s*(\[\d+\])?\s*:\s*)+", re.IGNORECASE)
+
+def normalize_subject(subject):
+    """Lowercase, strip reply/forward prefixes and tokenize a subject."""
+    if not subject:
+        return []
+    subject = REPLY_PREFIX.sub("", subject.lower())
+    return TOKEN_PATTERN.findall(subject)
+
+
+class SubjectIdf:
+    """Smoothed idf table over a user's email subjects, as in sklearn's TfidfVectorizer.
+
+    Batch re-clustering and online threading weight subjects with the same
+    table, so a score means the same thing in both. Unseen tokens get the
+    idf of a term found in no subject.
+    """
+
+    def __init__(self, document_frequencies=None, documents=0):
+        self.document_frequencies = dict(document_frequencies or {})
+        self.documents = documents
+
+    @classmethod
+    def fit(cls, subjects):
+        """Count each token once per subject."""
+        df = Counter()
+        for subject in subjects:
+            df.update(set(normalize_subject(subject)))
+        return cls(df, len(subjects))
+
+    def idf(self, token):
+        return math.log((1 + self.documents) / (1 + self.document_frequencies.get(token, 0))) + 1
+
+    def unit_vector(self, subject):
+        """L2-normalized TF-IDF weights of a normalized subject, as {token: weight}."""
+        counts = Counter(normalize_subject(subject))
+        if not counts:
+            return {}
+        weights = {token: c * self.idf(token) for token, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        return {token: w / norm for token, w in weights.items()}
+
+
+class ThreadCentroidIndex:
+    """One centroid per smart thread; subjects are matched against threads, not emails.
+
+    A centroid is the sum of its members' unit TF-IDF vectors under ``idf``,
+    so the score of a subject is its cosine similarity (0-100) with the
+    thread's mean subject, and adding a member is an O(subject length) update.
+    """
+
+    def __init__(self, idf=None):
+        self.idf = idf or SubjectIdf()
+        self._lock = threading.Lock()
+        self._threads = {}      # thread id -> [seq, weights, sum of squares, size]
+        self._postings = {}     # token -> set of thread ids
+
+    def __len__(self):
+        return len(self._threads)
+
+    def _add_weights(self, smart_thread_id, weights, size):
+        entry = self._threads.get(smart_thread_id)
+        if entry is None:
+            entry = self._threads[smart_thread_id] = [len(self._threads), {}, 0.0, 0]
+        totals = entry[1]
+        for token, weight in weights.items():
+            old = totals.get(token, 0.0)
+            new = old + weight
+            totals[token] = new
+            entry[2] += new * new - old * old
+            self._postings.setdefault(token, set()).add(smart_thread_id)
+        entry[3] += size
+
+    def set_centroid(self, smart_thread_id, weights, size):
+        """Load a stored centroid (unit weights under the same idf, summed over ``size`` subjects)."""
+        with self._lock:
+            old = self._threads.pop(smart_thread_id, None)
+            if old is not None:
+                for token in old[1]:
+                    postings = self._postings[token]
+                    postings.discard(smart_thread_id)
+                    if not postings:
+                        del self._postings[token]
+            self._add_weights(smart_thread_id, weights, size)
+
+    def add(self, subject, smart_thread_id):
+        if not smart_thread_id:
+            return
+        weights = self.idf.unit_vector(subject)
+        if not weights:
+            return
+        with self._lock:
+            self._add_weights(smart_thread_id, weights, 1)
+
+    def best_match(self, subject, threshold=85):
+        """Return (smart_thread_id, score) of the closest centroid above threshold."""
+        query = self.idf.unit_vector(subject)
+        if not query:
+            return None, 0
+
+        with self._lock:
+            dots = {}
+            for token, q_weight in query.items():
+                for thread_id in self._postings.get(token, ()):
+                    dots[thread_id] = dots.get(thread_id, 0.0) + q_weight * self._threads[thread_id][1][token]
+
+            best = None
+            for thread_id, dot in dots.items():
+                seq, _, sum_sq, _ = self._threads[thread_id]
+                score = dot / math.sqrt(sum_sq) * 100
+                if score > threshold and (
+                    best is None or score > best[0] or (score == best[0] and seq < best[1])
+                ):
+                    best = (score, seq, thread_id)
+
+        if best is None:
+            return None, 0
+        return best[2], best[0]
@@ -1,5 +1,8 @@
+import numpy as np
+from scipy.sparse import csr_matrix
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from utils.subject_index import SubjectIdf
 
 def subject_similarity(subject1, subject2):
     texts = [subject1.lower(), subject2.lower()]
@@ -8,3 +11,99 @@ def subject_similarity(subject1, subject2):
     
     sim_score = cosine_similarity([vectors[0]], [vectors[1]])[0][0]
     return sim_score * 100  # return percentage
+
+
+def _fit_subjects(*groups):
+    """Fit one TF-IDF vocabulary over all subject groups and return their sparse rows."""
+    texts = [(s or "").lower() for group in groups for s in group]
+    try:
+        matrix = TfidfVectorizer().fit_transform(texts)  # rows are L2-normalized
+    except ValueError:
+        # Every subject was empty or stop-word only
+        matrix = None
+
+    rows = []
+    start = 0
+    for group in groups:
+        end = start + len(group)
+        rows.append(matrix[start:end] if matrix is not None else None)
+        start = end
+    return rows
+
+
+def _weighted_subjects(subjects, idf):
+    """Sparse unit TF-IDF rows under a given idf table, or None if no subject has tokens."""
+    vocabulary = {}
+    indptr, indices, data = [0], [], []
+    for subject in subjects:
+        for token, weight in idf.unit_vector(subject).items():
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+            data.append(weight)
+        indptr.append(len(indices))
+    if not vocabulary:
+        return None
+    return csr_matrix((data, indices, indptr), shape=(len(subjects), len(vocabulary)))
+
+
+def subject_similarity_batch(query, candidates):
+    """Similarity (0-100) of one subject against many, in a single sparse pass."""
+    if not candidates:
+        return np.zeros(0)
+
+    q, c = _fit_subjects([query], candidates)
+    if q is None:
+        return np.zeros(len(candidates))
+
+    return (c @ q.T).toarray().ravel() * 100
+
+
+def subject_similarity_matrix(subjects_a, subjects_b=None):
+    """Sparse N x M similarity matrix (0-100) between two subject lists.
+
+    With one list the matrix is N x N over that list. Scores are computed
+    against a shared vocabulary, so idf weights come from the whole batch
+    rather than from each pair on its own.
+    """
+    if subjects_b is None:
+        (a,) = _fit_subjects(subjects_a)
+        b = a
+    else:
+        a, b = _fit_subjects(subjects_a, subjects_b)
+
+    if a is None:
+        m = len(subjects_a) if subjects_b is None else len(subjects_b)
+        return csr_matrix((len(subjects_a), m))
+
+    return (a @ b.T).tocsr() * 100
+
+
+def group_similar_subjects(subjects, threshold=85, block_size=500, idf=None):
+    """Group subjects whose similarity is above threshold; returns a label per subject.
+
+    Pairs are found block by block over the sparse similarity matrix and
+    merged with union-find, so memory stays bounded by ``block_size`` rows.
+    Subjects are weighted with ``idf`` (a SubjectIdf) when given, otherwise
+    with one fitted over ``subjects``.
+    """
+    n = len(subjects)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    vectors = _weighted_subjects(subjects, idf or SubjectIdf.fit(subjects))
+    if vectors is not None:
+        cutoff = threshold / 100
+        for start in range(0, n, block_size):
+            # Only the upper triangle (j >= i) is needed
+            block = (vectors[start:start + block_size] @ vectors[start:].T).tocoo()
+            keep = (block.row < block.col) & (block.data > cutoff)
+            for i, j in zip(block.row[keep] + start, block.col[keep] + start):
+                ri, rj = find(i), find(j)
+                if ri != rj:
+                    parent[max(ri, rj)] = min(ri, rj)
+
+    return [int(find(i)) for i in range(n)]